@@ -8,6 +8,7 @@ from sanic_cors import CORS
 from genaipf.middlewares.user_token_middleware import check_user
 from genaipf.middlewares.user_log_middleware import save_user_log
 from sanic_session import Session
+from genaipf.dispatcher.openai_transport import setup_openai_transport, close_openai_transport
 
 Sanic(server.SERVICE_NAME)
 app = Sanic.get_app()
@@ -31,6 +32,9 @@ app.blueprint(routers.blueprint_v1)
 app.blueprint(routers.blueprint_chatbot)
 app.register_middleware(check_user, "request")
 app.register_middleware(save_user_log, "request")
+# 每个 worker 共享的 OpenAI 连接池
+app.register_listener(setup_openai_transport, "before_server_start")
+app.register_listener(close_openai_transport, "after_server_stop")
 
 # parameter for different modes
 parser = argparse.ArgumentParser(description=f"{server.SERVICE_NAME} usage",
@@ -52,5 +56,6 @@ if __name__ == "__main__":
         if server.IS_INNER_DEBUG:
             app.run(host=server.HOST, port=server.PORT)
         else:
-            # workers的数量可以单独设置，如果设置为fast则默认为8
-            app.run(host=server.HOST, port=server.PORT, fast=True)
+            # workers的数量可以单独设置（SERVER_WORKERS），默认和fast一样取CPU核数
+            # 上游限流配额按worker数平分，两边要用同一个值
+            app.run(host=server.HOST, port=server.PORT, workers=server.WORKERS)
@@ -0,0 +1,63 @@
+'''
+序列化开销对比：SSE 文本帧和 common_response.success 的响应体
+旧版是 json.dumps({"text": ...}) / 默认 json 编码，新版是 utils.json_utils（有 orjson 时用 orjson）
+
+python benchmarks/bench_serialization.py
+'''
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from genaipf.utils.json_utils import JSON_BACKEND, text_frame, dumps, dumps_bytes, loads
+
+ROUNDS = 200000
+
+
+def bench(name, func, arg, rounds=ROUNDS):
+    t = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    cost = (time.perf_counter() - t) / rounds * 1e6
+    print(f"{name:<36} {cost:8.3f} us")
+    return cost
+
+
+def compare(title, old, new, arg, rounds=ROUNDS):
+    print(title)
+    a = bench("  old", old, arg, rounds)
+    b = bench(f"  new ({JSON_BACKEND})", new, arg, rounds)
+    print(f"  {a / b:.1f}x\n")
+
+
+def main():
+    for delta in ("Bitcoin ", "比特币价格", "Bitcoin price moved 3.2% in the last 24 hours. " * 5):
+        assert json.loads(text_frame(delta)) == {"text": delta}
+        compare(f"text frame, {len(delta)} chars", lambda x: json.dumps({"text": x}), text_frame, delta)
+
+    message = {
+        "type": "coin_price",
+        "subtype": "price",
+        "content": "Bitcoin price moved 3.2% in the last 24 hours. 比特币价格在过去24小时波动。" * 10,
+        "presetContent": {"name": "bitcoin", "price": [67000.5 + i for i in range(200)]},
+        "code": 1234567,
+    }
+    message_list = {
+        "messageList": [
+            {"id": i, "type": "gpt", "msggroup": "abc", "create_time": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "content": message}
+            for i in range(20)
+        ]
+    }
+    response_body = {"code": 200, "data": message_list, "message": "success", "status": "true"}
+    compare("success() body, 20 messages", lambda x: json.dumps(x, separators=(",", ":")).encode("utf-8"), dumps_bytes, response_body, 2000)
+
+    stored = json.dumps(message)
+    assert loads(stored) == json.loads(stored)
+    compare("getMessageList loads, 1 message", json.loads, loads, stored, 20000)
+    compare("[DATA] frame dumps", json.dumps, dumps, message, 20000)
+
+
+if __name__ == "__main__":
+    main()
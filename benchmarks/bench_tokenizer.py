@@ -0,0 +1,66 @@
+'''
+分词截断的 CPU 开销对比：旧版 limit_tokens_from_string（每次 encoding_for_model + 全量编码）
+和 dispatcher.tokenizer（缓存 encoder，只编码需要的前缀）
+
+python benchmarks/bench_tokenizer.py
+'''
+import os
+import sys
+import time
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from genaipf.dispatcher.tokenizer import truncate_tokens, count_tokens
+
+MODEL = "gpt-3.5-turbo-16k"
+# 和 merge_ref_and_qa 一样：一次截断到 8000，一次截断到 8000 + 3000
+LIMITS = (8000, 11000)
+ROUNDS = 50
+
+
+def old_limit_tokens_from_string(string, model, limit):
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except:
+        encoding = tiktoken.encoding_for_model('gpt2')
+    encoded = encoding.encode(string)
+    return encoding.decode(encoded[:limit])
+
+
+def bench(name, func, text):
+    t = time.perf_counter()
+    for _ in range(ROUNDS):
+        for limit in LIMITS:
+            func(text, MODEL, limit)
+    cost = (time.perf_counter() - t) / ROUNDS * 1000
+    print(f"{name:<28} {cost:8.2f} ms / request")
+    return cost
+
+
+def main():
+    paragraph = "Bitcoin price moved 3.2% in the last 24 hours while ETH/BTC stayed flat. 比特币价格在过去24小时波动。 "
+    # 没有空格和标点的中文整段是一个预分词片段，切口会落在片段中间
+    cjk = "比特币价格在过去二十四小时内大幅波动以太坊兑比特币汇率保持稳定市场情绪依然谨慎" * 1000
+    texts = (("~50k tokens", paragraph * 2000), ("~5k tokens", paragraph * 200), ("unspaced CJK", cjk))
+    for n_tokens_hint, text in texts:
+        print(f"ref text {n_tokens_hint}, {len(text)} chars")
+        old = bench("old limit_tokens_from_string", old_limit_tokens_from_string, text)
+        new = bench("tokenizer.truncate_tokens", truncate_tokens, text)
+        print(f"saved {old - new:.2f} ms CPU per request ({old / new:.1f}x)\n")
+        for limit in LIMITS + (1, 777):
+            assert truncate_tokens(text, MODEL, limit) == old_limit_tokens_from_string(text, MODEL, limit)
+
+    qa_answer = paragraph * 20
+    t = time.perf_counter()
+    for _ in range(ROUNDS * 10):
+        len(tiktoken.encoding_for_model(MODEL).encode(qa_answer))
+    old = (time.perf_counter() - t) / (ROUNDS * 10) * 1000
+    t = time.perf_counter()
+    for _ in range(ROUNDS * 10):
+        count_tokens(qa_answer, MODEL)
+    new = (time.perf_counter() - t) / (ROUNDS * 10) * 1000
+    print(f"repeated QA answer count: {old:.3f} ms -> {new:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
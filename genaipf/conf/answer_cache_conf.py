@@ -0,0 +1,10 @@
+import os
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+# 文本模式回答的语义缓存，默认关闭
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIM_TH = float(os.getenv("ANSWER_CACHE_SIM_TH", 0.97))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 60 * 60 * 6))
+# 不参与缓存的函数（preset 名），也可以在 preset_entry_mapping 里配置 "answer_cache": False
+ANSWER_CACHE_EXCLUDED_FUNCS = [x.strip() for x in os.getenv("ANSWER_CACHE_EXCLUDED_FUNCS", "").split(",") if x.strip()]
@@ -0,0 +1,18 @@
+import os
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+# 跨请求合并 embedding 调用：单批最大条数、最长等待时间（毫秒）
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 64))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5))
+# 两级 embedding 缓存：进程内 LRU 的字节上限，Redis 共享缓存的开关和过期时间（秒）
+EMBEDDING_L1_MAX_BYTES = int(os.getenv("EMBEDDING_L1_MAX_BYTES", 64 * 1024 * 1024))
+EMBEDDING_L2_ENABLED = os.getenv("EMBEDDING_L2_ENABLED", "true").lower() == "true"
+EMBEDDING_L2_TTL = int(os.getenv("EMBEDDING_L2_TTL", 60 * 60 * 24 * 7))
+# 磁盘 embedding 库：create_vdb 总会使用，在线服务是否以只读方式使用
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "./embedding_store")
+EMBEDDING_STORE_ONLINE = os.getenv("EMBEDDING_STORE_ONLINE", "false").lower() == "true"
+# embedding 提供方：openai、hashing（本地确定性哈希，用于压测）、sentence_transformers
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_LOCAL_MODEL = os.getenv("EMBEDDING_LOCAL_MODEL", "all-MiniLM-L6-v2")
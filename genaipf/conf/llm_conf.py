@@ -0,0 +1,26 @@
+import os
+import json
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+# system prompt 里当前时间的精度（秒），同一时间段内 prompt 前缀字节级一致，可以被缓存
+PROMPT_TIME_GRANULARITY = int(os.getenv("PROMPT_TIME_GRANULARITY", 60))
+# 每个 worker 访问 OpenAI 的连接池：连接数上限、keep-alive、DNS 缓存时间（秒）和超时（秒）
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", 100))
+OPENAI_KEEPALIVE_TIMEOUT = float(os.getenv("OPENAI_KEEPALIVE_TIMEOUT", 60))
+OPENAI_DNS_CACHE_TTL = int(os.getenv("OPENAI_DNS_CACHE_TTL", 300))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", 600))
+# 上游限流：每个模型的 [每分钟请求数, 每分钟 token 数]，是所有 worker 合计的配额，每个 worker 分到 1/SERVER_WORKERS
+LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", '{"gpt-3.5-turbo-16k": [3500, 180000], "gpt-4": [200, 40000]}'))
+# 排队的请求数上限、单个请求最长排队时间（秒），超出时直接返回繁忙
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 200))
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", 30))
+# 优先级通道：paid（ml-plus 用户）和 free 的调度权重，以及 paid 有请求排队时给它预留的配额比例
+LLM_LANE_WEIGHTS = json.loads(os.getenv("LLM_LANE_WEIGHTS", '{"paid": 4, "free": 1}'))
+LLM_PAID_RESERVED_SHARE = float(os.getenv("LLM_PAID_RESERVED_SHARE", 0.3))
+# 上游返回 429 后暂停放行的时间（秒）：有 Retry-After 按它来，否则从 BACKOFF 开始连续翻倍，最多 MAX_BACKOFF
+LLM_RATE_LIMIT_BACKOFF = float(os.getenv("LLM_RATE_LIMIT_BACKOFF", 1))
+LLM_RATE_LIMIT_MAX_BACKOFF = float(os.getenv("LLM_RATE_LIMIT_MAX_BACKOFF", 20))
+# 相同请求（模型、消息、参数完全一致）正在生成时，后来的请求复用同一个上游流；默认关闭，确认回答可以共享后再打开
+LLM_STREAM_DEDUP_ENABLED = os.getenv("LLM_STREAM_DEDUP_ENABLED", "false").lower() == "true"
@@ -14,3 +14,17 @@ LOG_PATH = os.getenv("SERVER_LOG_PATH")
 PROJ_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FONT_PATH = f"{PROJ_PATH}/static/arial.ttf"
 IS_INNER_DEBUG = True if os.getenv("IS_INNER_DEBUG") else False
+# worker 进程数，默认和 fast=True 一样取 CPU 核数；调试模式只有一个 worker
+WORKERS = 1 if IS_INNER_DEBUG else int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+# SSE 文本帧合并：最多攒多少毫秒 / 多少字节再写一次
+SSE_COALESCE_MS = int(os.getenv("SSE_COALESCE_MS", 20))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", 256))
+# 可续传的回答流：帧缓存在 Redis Stream 里，断线后用 code + offset 续传
+# 只对请求里带 resumable: true 的客户端生效，这些客户端断开后上游还会继续生成 CHAT_STREAM_RESUME_GRACE 秒
+CHAT_STREAM_RESUME_ENABLED = os.getenv("CHAT_STREAM_RESUME_ENABLED", "false").lower() == "true"
+CHAT_STREAM_TTL = int(os.getenv("CHAT_STREAM_TTL", 300))
+CHAT_STREAM_MAX_FRAMES = int(os.getenv("CHAT_STREAM_MAX_FRAMES", 4000))
+CHAT_STREAM_MAX_BYTES = int(os.getenv("CHAT_STREAM_MAX_BYTES", 512 * 1024))
+# 客户端断开后继续生成多久等待续传，期间没有续传就取消上游
+CHAT_STREAM_RESUME_GRACE = float(os.getenv("CHAT_STREAM_RESUME_GRACE", 15))
+CHAT_STREAM_POLL_MS = int(os.getenv("CHAT_STREAM_POLL_MS", 100))
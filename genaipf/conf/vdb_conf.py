@@ -0,0 +1,13 @@
+import os
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+# 向量检索后端：qdrant 或 local（进程内 mmap 矩阵，只用于下面列出的小集合）
+VDB_BACKEND = os.getenv("VDB_BACKEND", "qdrant")
+LOCAL_VDB_COLLECTIONS = [x.strip() for x in os.getenv("LOCAL_VDB_COLLECTIONS", "gpt_func,filtered_qa").split(",") if x.strip()]
+LOCAL_VDB_PATH = os.getenv("LOCAL_VDB_PATH", "./local_vdb")
+# python app.py -a 同步向量库时的 embedding 批大小、并发数、单次 upsert 条数
+VDB_SYNC_EMBED_BATCH_SIZE = int(os.getenv("VDB_SYNC_EMBED_BATCH_SIZE", 100))
+VDB_SYNC_CONCURRENCY = int(os.getenv("VDB_SYNC_CONCURRENCY", 4))
+VDB_SYNC_UPSERT_CHUNK = int(os.getenv("VDB_SYNC_UPSERT_CHUNK", 500))
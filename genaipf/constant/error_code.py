@@ -14,7 +14,10 @@ ERROR_CODE = {
     "NOT_AUTHORIZED": 4001,
     "TOKEN_NOT_SUPPORTED": 5001,
     "PLATFORM_NOT_SUPPORTED": 5003,
-    "NO_REMAINING_TIMES": 5004
+    "NO_REMAINING_TIMES": 5004,
+    "SERVER_BUSY": 5005,
+    "STREAM_NOT_RESUMABLE": 5006,
+    "CONTEXT_TOO_LONG": 5007
 }
 
 # 错误信息
@@ -33,5 +36,8 @@ ERROR_MESSAGE = {
     4001: 'User Not Authorized',
     5001: 'The token you mentioned not supported',
     5003: 'The platform not supported swap',
-    5004: 'No remaining times'
+    5004: 'No remaining times',
+    5005: 'Server is busy, please try again later',
+    5006: 'The answer can not be resumed, please send again',
+    5007: 'The question is too long, please shorten it and try again'
 }
@@ -6,4 +6,12 @@ REDIS_KEYS = {
         'EMAIL_LIMIT': 'EMAIL:{}:{}',
         'EMAIL_CONTINUE': 'EMAIL_CONTINUE_{}'
     },
+    'EMBEDDING_KEYS': {
+        'EMBEDDING': 'EMBEDDING:{}:{}'
+    },
+    'CHAT_STREAM_KEYS': {
+        'FRAMES': 'CHAT_STREAM:{}',
+        'META': 'CHAT_STREAM_META:{}',
+        'QUESTION': 'CHAT_STREAM_QUESTION:{}'
+    },
 }
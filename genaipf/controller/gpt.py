@@ -3,7 +3,7 @@ from genaipf.exception.customer_exception import CustomerError
 from genaipf.constant.error_code import ERROR_CODE
 from genaipf.interfaces.common_response import success,fail
 import requests
-import json
+import genaipf.utils.json_utils as json_utils
 # import snowflake.client
 import genaipf.services.gpt_service as gpt_service
 from datetime import datetime
@@ -34,7 +34,7 @@ async def get_message_list(request: Request):
     for message in messageList:
         message['create_time'] = message['create_time'].strftime('%Y-%m-%d %H:%M:%S')
         if message['type'] != 'user':
-            message['content'] = json.loads(message['content'])
+            message['content'] = json_utils.loads(message['content'])
         else:
             message['content'] = {
                 'type': 'user',
@@ -5,26 +5,42 @@ import openai
 from sanic import Request, response
 from sanic.response import ResponseStream
 from genaipf.exception.customer_exception import CustomerError
-from genaipf.constant.error_code import ERROR_CODE
+from genaipf.constant.error_code import ERROR_CODE, ERROR_MESSAGE
 from genaipf.interfaces.common_response import success,fail
 import requests
-import json
+import genaipf.utils.json_utils as json_utils
 # import snowflake.client
 import genaipf.services.gpt_service as gpt_service
 from genaipf.controller.preset_entry import preset_entry_mapping
 import genaipf.services.user_account_service_wrapper as user_account_service_wrapper
 from datetime import datetime
 from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import StageTimer, get_metrics
+from genaipf.utils.sse_utils import SSEFrameWriter, TextDelta, ClientDisconnected
 import time
 from pprint import pprint
-from genaipf.dispatcher.api import gpt_functions, afunc_gpt4_generator, aref_answer_gpt_generator
-from genaipf.dispatcher.utils import get_qa_vdb_topk, merge_ref_and_input_text
+from genaipf.dispatcher.api import gpt_functions, afunc_gpt4_generator, aref_answer_gpt_generator, max_tokens
+from genaipf.dispatcher.tokenizer import count_tokens
+from genaipf.dispatcher.utils import merge_ref_and_input_text
+from genaipf.dispatcher.retrieval_context import RetrievalContext
+from genaipf.dispatcher.streaming_args import PresetPrefetch
+from genaipf.dispatcher.preset_cache import preset_cache
+from genaipf.dispatcher.direct_answer import render_direct_answer
+from genaipf.dispatcher.answer_cache import answer_cache
 from genaipf.dispatcher.prompts_v001 import LionPrompt
 # from dispatcher.gptfunction import unfiltered_gpt_functions, gpt_function_filter
 from genaipf.dispatcher.functions import gpt_functions_mapping, gpt_function_filter
 from genaipf.dispatcher.postprocess import posttext_mapping, PostTextParam
 from genaipf.utils.redis_utils import RedisConnectionPool
-from genaipf.conf.server import IS_INNER_DEBUG
+from genaipf.conf.server import IS_INNER_DEBUG, CHAT_STREAM_RESUME_ENABLED, CHAT_STREAM_RESUME_GRACE
+from genaipf.services.chat_stream_service import (
+    ChatStreamBuffer,
+    STATUS_DONE,
+    new_resume_token,
+    get_stream_meta,
+    follow_stream,
+    mark_question_seen,
+)
 import os
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -33,6 +49,13 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 proxy = { 'https' : '127.0.0.1:8001'}
 
 executor = ThreadPoolExecutor(max_workers=10)
+chat_stream_metrics = get_metrics("chat_stream")
+# 关掉 nginx 等代理的响应缓冲，帧到了就转发
+SSE_HEADERS = {"accept": "application/json", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# 续传时生成端超过这么久没有新帧就结束
+RESUME_IDLE_SECONDS = 60
+# 生成端和写 socket 之间最多缓存的帧数，写不动时生成端等待，不再继续读上游
+STREAM_QUEUE_SIZE = 64
 
 async def http(request: Request):
     return response.json({"http": "sendchat"})
@@ -57,31 +80,167 @@ async def send_strem_chat(request: Request):
     device_no = request.remote_addr
     question_code = request_params.get('code', '')
     model = request_params.get('model', '')
+    resumable = request_params.get('resumable') is True
 
     messages = messages[-10:]
     if not IS_INNER_DEBUG and model == 'ml-plus':
         can_use = await user_account_service_wrapper.get_user_can_use_time(userid)
-        if can_use > 0:
-            await user_account_service_wrapper.minus_one_user_can_use_time(userid)
-        else:
+        if can_use <= 0:
             raise CustomerError(status_code=ERROR_CODE['NO_REMAINING_TIMES'])
+        # 拿到上游配额、确定开始回答后才扣次数，排队被拒（SERVER_BUSY）不扣
+        on_answer_start = lambda: user_account_service_wrapper.minus_one_user_can_use_time(userid)
+    else:
+        on_answer_start = None
     
+    # 回答的 code 在开始生成前就确定，前导帧、续传和存库都用它
+    _code = await asyncio.get_running_loop().run_in_executor(executor, generate_unique_id)
     try:
         async def event_generator(_response):
             # async for _str in getAnswerAndCallGpt(request_params['content'], userid, msggroup, language, messages):
-            async for _str in getAnswerAndCallGpt(request_params.get('content'), userid, msggroup, language, messages, device_no, question_code, model):
-                await _response.write(f"data:{_str}\n\n")
-                await asyncio.sleep(0.01)
-        return ResponseStream(event_generator, headers={"accept": "application/json"}, content_type="text/event-stream")
+            stream_buffer = None
+            resume_token = None
+            # 只给声明支持续传的客户端（resumable: true）缓冲；其他客户端断开时立即取消上游
+            if CHAT_STREAM_RESUME_ENABLED and resumable:
+                resume_token = new_resume_token()
+                stream_buffer = ChatStreamBuffer(_code, resume_token)
+            writer = SSEFrameWriter(_response, on_frames=stream_buffer.append if stream_buffer else None)
+            answer_gen = getAnswerAndCallGpt(request_params.get('content'), userid, msggroup, language, messages, device_no, question_code, model, _code, on_answer_start)
+            # 生成放在单独的 task 里：客户端断开时 sanic 会取消当前 task，生成端还可以继续写缓冲等待续传
+            frames = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+            producer = asyncio.ensure_future(_produce_frames(answer_gen, frames))
+            detached = False
+            try:
+                # 前导帧：不等检索和上游首包，立即把 code 和 thinking 状态发给前端
+                await writer.send(_code_frame(_code, resume_token, status="thinking"))
+                while True:
+                    item = await frames.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    await writer.send(item)
+            except CustomerError as e:
+                # 流已经开始，错误（如上游繁忙）只能作为一帧发给前端
+                await writer.send("[ERROR]")
+                await writer.send(json_utils.dumps({'code': e.status_code, 'message': ERROR_MESSAGE.get(e.status_code)}))
+            except (ClientDisconnected, asyncio.CancelledError) as e:
+                chat_stream_metrics.incr("client_disconnects")
+                if stream_buffer is not None and stream_buffer.resumable:
+                    detached = True
+                    asyncio.ensure_future(_continue_for_resume(frames, producer, writer, stream_buffer))
+                else:
+                    # 取消生成，让它停止读取上游并保存部分回答
+                    producer.cancel()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            finally:
+                if not detached:
+                    await writer.close()
+                    if stream_buffer is not None:
+                        await stream_buffer.finish()
+        if question_code:
+            asyncio.ensure_future(_count_regeneration(question_code))
+        return ResponseStream(event_generator, headers=SSE_HEADERS, content_type="text/event-stream")
 
     except Exception as e:
         logger.error(e)
         logger.error(traceback.format_exc())
 
 
+async def resume_strem_chat(request: Request):
+    '''
+    断线续传：code、resume_token 来自 sendStremChat 的前导帧，offset 是客户端已经收到的帧数，
+    从第 offset+1 帧开始回放，生成还没结束时继续跟随，不会重新请求上游
+    '''
+    request_params = request.json
+    _code = request_params.get('code')
+    resume_token = request_params.get('resume_token')
+    try:
+        offset = int(request_params.get('offset', 0))
+    except (TypeError, ValueError):
+        raise CustomerError(status_code=ERROR_CODE['PARAMS_ERROR'])
+    if offset < 0:
+        raise CustomerError(status_code=ERROR_CODE['PARAMS_ERROR'])
+    meta = await get_stream_meta(_code) if _code and resume_token else None
+    if not meta or meta.get('token') != resume_token:
+        chat_stream_metrics.incr("resume_rejected")
+        raise CustomerError(status_code=ERROR_CODE['STREAM_NOT_RESUMABLE'])
+    chat_stream_metrics.incr("resumes")
+
+    async def event_generator(_response):
+        writer = SSEFrameWriter(_response)
+        try:
+            async for frames in follow_stream(_code, offset, RESUME_IDLE_SECONDS):
+                chat_stream_metrics.incr("resume_frames", len(frames))
+                await writer.send_frames(frames)
+            meta = await get_stream_meta(_code)
+            if meta.get('status') != STATUS_DONE:
+                # 缓冲超限、生成中断或生成端已经不在了，客户端需要重新发送
+                await writer.send("[ERROR]")
+                await writer.send(json_utils.dumps({'code': ERROR_CODE['STREAM_NOT_RESUMABLE'], 'message': ERROR_MESSAGE[ERROR_CODE['STREAM_NOT_RESUMABLE']]}))
+        except ClientDisconnected:
+            pass
+        finally:
+            await writer.close()
+    return ResponseStream(event_generator, headers=SSE_HEADERS, content_type="text/event-stream")
+
+
+_STREAM_END = object()
+
+
+async def _produce_frames(answer_gen, frames):
+    try:
+        async for _str in answer_gen:
+            await frames.put(_str)
+    except asyncio.CancelledError:
+        # 取消可能落在 put 上，这时生成器停在 yield，要显式关闭才会保存部分回答、关闭上游；
+        # 取消后没有人再读队列，不放结束标记
+        await answer_gen.aclose()
+        raise
+    except Exception as e:
+        await frames.put(e)
+    await frames.put(_STREAM_END)
+
+
+async def _continue_for_resume(frames, producer, writer, stream_buffer):
+    '''客户端断开后继续把回答写进缓冲等待续传；宽限期过后没有续传请求就取消生成'''
+    writer.detach()
+    deadline = time.time() + CHAT_STREAM_RESUME_GRACE
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(frames.get(), 1)
+            except asyncio.TimeoutError:
+                item = None
+            if item is _STREAM_END or isinstance(item, Exception):
+                break
+            if item is None and producer.done():
+                # 生成已被取消，不会再有结束标记
+                break
+            if item is not None:
+                await writer.send(item)
+            if deadline is not None and time.time() > deadline and not await stream_buffer.has_reader():
+                chat_stream_metrics.incr("resume_abandoned")
+                deadline = None
+                producer.cancel()
+    except Exception as e:
+        logger.error(f'continue for resume error {e}')
+    finally:
+        await writer.close()
+        await stream_buffer.finish()
+
+
+async def _count_regeneration(question_code):
+    try:
+        if await asyncio.get_running_loop().run_in_executor(executor, mark_question_seen, question_code):
+            chat_stream_metrics.incr("regenerations")
+    except Exception as e:
+        logger.error(f'count regeneration error {e}')
+
+
    
 
-async def  getAnswerAndCallGpt(question, userid, msggroup, language, front_messages, device_no, question_code, model):
+async def  getAnswerAndCallGpt(question, userid, msggroup, language, front_messages, device_no, question_code, model, _code, on_answer_start=None):
     t0 = time.time()
     MAX_CH_LENGTH = 8000
     _ensure_ascii = False
@@ -96,123 +255,200 @@ async def  getAnswerAndCallGpt(question, userid, msggroup, language, front_messa
     user_history_l = [x["content"] for x in messages if x["role"] == "user"]
     newest_question = user_history_l[-1]
     data = {}
+    # 本轮对话内共享 embedding 和向量检索结果
+    retrieval_ctx = RetrievalContext()
+    stage_timer = StageTimer("chat_stages")
     
     # vvvvvvvv 在第一次 func gpt 就准备好数据 vvvvvvvv
+    _messages = [x for x in messages if x["role"] != "system"]
+    # msgs = _messages[:-1] + [{"role": "user", "content": merged_ref_text}]
+    msgs = _messages[::]
+    # QA 检索和函数筛选互不依赖，并发执行（共用同一个问题的 embedding）
+    related_qa, used_gpt_functions = await asyncio.gather(
+        stage_timer.timed("qa_retrieval", retrieval_ctx.qa_topk(newest_question)),
+        stage_timer.timed("function_filter", gpt_function_filter(gpt_functions_mapping, _messages, retrieval_ctx=retrieval_ctx)),
+    )
+    stage_timer.mark("retrieval")
     ref_text = ""
-    related_qa = get_qa_vdb_topk(newest_question)
     ref_text += "\n\n可能相关的历史问答:\n" + "\n\n".join(related_qa)
     ref_text = ref_text[:MAX_CH_LENGTH + 3000]
     logger.info(f'>>>>> frist ref_text: {ref_text}')
     merged_ref_text = merge_ref_and_input_text(ref_text, newest_question, language=language)
-    _messages = [x for x in messages if x["role"] != "system"]
-    # msgs = _messages[:-1] + [{"role": "user", "content": merged_ref_text}]
-    msgs = _messages[::]
     # ^^^^^^^^ 在第一次 func gpt 就准备好数据 ^^^^^^^^
     
-    used_gpt_functions = gpt_function_filter(gpt_functions_mapping, _messages)
-    # resp1 = await afunc_gpt4_generator(msgs, used_gpt_functions, language, model)
-    resp1 = await afunc_gpt4_generator(msgs, used_gpt_functions, language, model, "", related_qa)
-    chunk = await resp1.__anext__()
-    _func_or_text = chunk['choices'][0]['delta'].get("function_call", None)
-    if _func_or_text:
-        mode1 = "func"
-        logger.info(f">>>>> activate gpt function >>>>>")
-    else:
-        mode1 = "text"
-    if mode1 == "text":
-        c0 = chunk['choices'][0]['delta'].get("content", "")
-        _tmp_text = ""
-        _tmp_text += c0
-        yield '[GPT]'
-        _code = generate_unique_id()    
-        yield json.dumps({"code": _code})
-        yield json.dumps({"text": c0})
-        async for chunk in resp1:
-            _gpt_letter = chunk['choices'][0]['delta'].get("content", "")
-            _tmp_text += _gpt_letter
-            yield json.dumps({"text": _gpt_letter})
-        yield "[DONE]"
-        data = {
-                'type' : 'gpt',
-                'content' : _tmp_text,
-                'code' : _code
-            }
-        logger.info(f'>>>>> text _tmp_text: {_tmp_text}')
-    elif mode1 == "func":
-        big_func_name = _func_or_text["name"]
-        func_name, sub_func_name = big_func_name.split("_____")
-        _arguments = _func_or_text["arguments"]
-        async for chunk in resp1:
-            _func_json = chunk['choices'][0]['delta'].get("function_call", {})
-            _arguments += _func_json.get("arguments", "")
-        _param = json.loads(_arguments)
-        _param["language"] = language
-        _param["subtype"] = sub_func_name
-        logger.info(f'>>>>> func_name: {func_name}, sub_func_name: {sub_func_name}, _arguments: {_arguments}')
-        t01 = time.time()
-        logger.info(f'>>>>> gpt func time: {t01 - t0}')
-        content = ""
-        _type = ""
-        presetContent = {}
-        picked_content=""
-        if func_name in preset_entry_mapping:
-            preset_conf = preset_entry_mapping[func_name]
-            _type = preset_conf["type"]
-            _args = [_param.get(x) for x in preset_conf["param_names"]]
-            presetContent, picked_content = await preset_conf["get_and_pick"](*_args)
-            if preset_conf.get("has_preset_content") and (_param.get("need_chart") or preset_conf.get("need_preset")):
-                data = {
-                    'type' : _type,
-                    'subtype': sub_func_name,
-                    'content' : content,
-                    'presetContent' : presetContent
+    # vvvvvvvv 语义缓存：相似问题直接返回之前的文本回答 vvvvvvvv
+    cached_answer = None
+    answer_cacheable = answer_cache.is_cacheable(used_gpt_functions, preset_entry_mapping)
+    if answer_cacheable:
+        question_vector = await retrieval_ctx.embedding(newest_question)
+        funcs_key = answer_cache.functions_key(used_gpt_functions)
+        cached_answer = await answer_cache.get(question_vector, language, model, funcs_key)
+    # ^^^^^^^^ 语义缓存：相似问题直接返回之前的文本回答 ^^^^^^^^
+    stage_timer.mark("answer_cache")
+    resp1 = resp2 = None
+    prefetch = None
+    _tmp_text = ""
+    try:
+        if cached_answer is not None:
+            mode1 = "cache"
+            logger.info(f">>>>> answer cache hit >>>>>")
+        else:
+            # resp1 = await afunc_gpt4_generator(msgs, used_gpt_functions, language, model)
+            resp1 = await afunc_gpt4_generator(msgs, used_gpt_functions, language, model, "", related_qa)
+            chunk = await resp1.__anext__()
+            stage_timer.mark("func_gpt_first_chunk")
+            _func_or_text = chunk['choices'][0]['delta'].get("function_call", None)
+            if _func_or_text:
+                mode1 = "func"
+                logger.info(f">>>>> activate gpt function >>>>>")
+            else:
+                mode1 = "text"
+        if on_answer_start is not None:
+            await on_answer_start()
+        # 路由确定后告诉前端接下来是直接回答还是先调用函数
+        yield json_utils.dumps({"status": mode1})
+        if mode1 == "cache":
+            yield '[GPT]'
+            yield _code_frame(_code)
+            yield TextDelta(cached_answer)
+            yield "[DONE]"
+            data = {
+                    'type' : 'gpt',
+                    'content' : cached_answer,
+                    'code' : _code
                 }
-
-        related_qa = get_qa_vdb_topk(newest_question)
-        merged_ref_text = LionPrompt.get_merge_ref_and_input_prompt(str(picked_content), related_qa, newest_question, language, _type, data)
-        # merged_ref_text = merge_ref_and_input_text(ref_text, newest_question)
-        _messages = [x for x in messages if x["role"] != "system"]
-        # msgs = _messages[:-1] + [{"role": "user", "content": merged_ref_text}]
-        msgs = _messages[::]
-        # resp2 = await aref_answer_gpt_generator(msgs, model="gpt-3.5-turbo-16k", language=language, preset_name=_type)
-        resp2 = await aref_answer_gpt_generator(msgs, model, language, _type, str(picked_content), related_qa)
-
-        # if data :
-        #     yield '[DATA]'
-        #     yield json.dumps(data)
-        _tmp_text = ""
-        t1 = time.time()
-        logger.info(f'>>>>> get data time: {t1 - t01}')
-        logger.info(f'>>>>> start->data done t1 - t0: {t1 - t0}')
-        # if func_name in preset_entry_mapping:
-        #     yield '[GPTFUNC]'
-        #     _gptfunc_data = {"role": "gptfunc", "function_call": {"name": big_func_name, "arguments": _arguments}}
-        #     yield json.dumps(_gptfunc_data)
-        yield "[GPT]"
-        async for chunk in resp2:
-            _gpt_letter = chunk['choices'][0]['delta'].get("content", "")
-            _tmp_text += _gpt_letter
-            yield json.dumps({"text": _gpt_letter})
-        posttexter = posttext_mapping.get(func_name)
-        if posttexter is not None:
-            async for _gpt_letter in posttexter.get_text_agenerator(PostTextParam(language, sub_func_name)):
+        elif mode1 == "text":
+            c0 = chunk['choices'][0]['delta'].get("content", "")
+            _tmp_text = ""
+            _tmp_text += c0
+            yield '[GPT]'
+            yield _code_frame(_code)
+            yield TextDelta(c0)
+            async for chunk in resp1:
+                _gpt_letter = chunk['choices'][0]['delta'].get("content", "")
                 _tmp_text += _gpt_letter
-                yield json.dumps({"text": _gpt_letter})
-        if len(data) == 0 :
+                yield TextDelta(_gpt_letter)
+            yield "[DONE]"
             data = {
-                'type' : 'gpt',
-                'content' : _tmp_text
-            }
-        else :
-            data['content'] = _tmp_text
-        # print(f'>>>>>test 002 : {data}')
-        if data :
-            _code = generate_unique_id()
-            data['code'] = _code
-            yield '[DATA]'
-            yield json.dumps(data)
-        yield "[DONE]"
-        logger.info(f'>>>>> func & ref _tmp_text: {_tmp_text}')
+                    'type' : 'gpt',
+                    'content' : _tmp_text,
+                    'code' : _code
+                }
+            logger.info(f'>>>>> text _tmp_text: {_tmp_text}')
+            if answer_cacheable and _tmp_text:
+                asyncio.ensure_future(answer_cache.put(question_vector, newest_question, _tmp_text, language, model, funcs_key))
+        elif mode1 == "func":
+            big_func_name = _func_or_text["name"]
+            func_name, sub_func_name = big_func_name.split("_____")
+            _arguments = _func_or_text["arguments"]
+            if func_name in preset_entry_mapping:
+                # 参数还在流式返回时，preset 需要的参数一齐就提前取数据
+                preset_conf = preset_entry_mapping[func_name]
+                prefetch = PresetPrefetch(
+                    preset_conf, gpt_functions_mapping.get(big_func_name), {"language": language, "subtype": sub_func_name},
+                    # 按 preset 声明的 cache 配置走缓存（single-flight + stale-while-revalidate）
+                    fetch=lambda args: preset_cache.get_and_pick(func_name, preset_conf, args),
+                )
+                prefetch.feed(_arguments)
+            async for chunk in resp1:
+                _func_json = chunk['choices'][0]['delta'].get("function_call", {})
+                _delta = _func_json.get("arguments", "")
+                _arguments += _delta
+                if prefetch is not None:
+                    prefetch.feed(_delta)
+            stage_timer.mark("func_arguments")
+            _param = json_utils.loads(_arguments)
+            _param["language"] = language
+            _param["subtype"] = sub_func_name
+            logger.info(f'>>>>> func_name: {func_name}, sub_func_name: {sub_func_name}, _arguments: {_arguments}')
+            t01 = time.time()
+            logger.info(f'>>>>> gpt func time: {t01 - t0}')
+            content = ""
+            _type = ""
+            presetContent = {}
+            picked_content=""
+            direct_text = None
+            if func_name in preset_entry_mapping:
+                preset_conf = preset_entry_mapping[func_name]
+                _type = preset_conf["type"]
+                _args = [_param.get(x) for x in preset_conf["param_names"]]
+                presetContent, picked_content = await prefetch.result(_args)
+                stage_timer.mark("preset_data")
+                if preset_conf.get("has_preset_content") and (_param.get("need_chart") or preset_conf.get("need_preset")):
+                    data = {
+                        'type' : _type,
+                        'subtype': sub_func_name,
+                        'content' : content,
+                        'presetContent' : presetContent
+                    }
+                # 只是把数据展示出来的 preset 直接用模板渲染回答，不调用第二轮模型
+                direct_text = render_direct_answer(preset_conf, language, presetContent, picked_content, _param)
+
+            if direct_text is None:
+                related_qa = await retrieval_ctx.qa_topk(newest_question)
+                merged_ref_text = LionPrompt.get_merge_ref_and_input_prompt(str(picked_content), related_qa, newest_question, language, _type, data)
+                # merged_ref_text = merge_ref_and_input_text(ref_text, newest_question)
+                _messages = [x for x in messages if x["role"] != "system"]
+                # msgs = _messages[:-1] + [{"role": "user", "content": merged_ref_text}]
+                msgs = _messages[::]
+                # resp2 = await aref_answer_gpt_generator(msgs, model="gpt-3.5-turbo-16k", language=language, preset_name=_type)
+                resp2 = await aref_answer_gpt_generator(msgs, model, language, _type, str(picked_content), related_qa)
+
+            # if data :
+            #     yield '[DATA]'
+            #     yield json_utils.dumps(data)
+            _tmp_text = ""
+            t1 = time.time()
+            logger.info(f'>>>>> get data time: {t1 - t01}')
+            logger.info(f'>>>>> start->data done t1 - t0: {t1 - t0}')
+            # if func_name in preset_entry_mapping:
+            #     yield '[GPTFUNC]'
+            #     _gptfunc_data = {"role": "gptfunc", "function_call": {"name": big_func_name, "arguments": _arguments}}
+            #     yield json_utils.dumps(_gptfunc_data)
+            stage_timer.mark("ref_answer_request")
+            # 和原来一样，func 分支 [GPT] 之后只有文本，code 在 [DATA] 里
+            yield "[GPT]"
+            if direct_text is not None:
+                _tmp_text += direct_text
+                yield TextDelta(direct_text)
+            else:
+                async for chunk in resp2:
+                    _gpt_letter = chunk['choices'][0]['delta'].get("content", "")
+                    _tmp_text += _gpt_letter
+                    yield TextDelta(_gpt_letter)
+            posttexter = posttext_mapping.get(func_name)
+            if posttexter is not None:
+                async for _gpt_letter in posttexter.get_text_agenerator(PostTextParam(language, sub_func_name)):
+                    _tmp_text += _gpt_letter
+                    yield TextDelta(_gpt_letter)
+            if len(data) == 0 :
+                data = {
+                    'type' : 'gpt',
+                    'content' : _tmp_text
+                }
+            else :
+                data['content'] = _tmp_text
+            # print(f'>>>>>test 002 : {data}')
+            if data :
+                data['code'] = _code
+                yield '[DATA]'
+                yield json_utils.dumps(data)
+            yield "[DONE]"
+            logger.info(f'>>>>> func & ref _tmp_text: {_tmp_text}')
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端断开：已生成的部分回答标记 truncated 后存库，上游流在 finally 里关闭
+        _on_stream_truncated(question, userid, msggroup, question_code, device_no, data, _tmp_text, _code, resp2 or resp1)
+        raise
+    finally:
+        if prefetch is not None:
+            prefetch.cancel()
+        await close_upstream_streams(resp1, resp2)
+    stage_timer.mark("answer_stream")
+    logger.info(f'>>>>> stage timings(ms): {stage_timer.summary()}')
+    await save_chat_messages(question, userid, msggroup, question_code, device_no, data)
+
+
+async def save_chat_messages(question, userid, msggroup, question_code, device_no, data):
     if question and msggroup :
         gpt_message = (
         question,
@@ -225,7 +461,9 @@ async def  getAnswerAndCallGpt(question, userid, msggroup, language, front_messa
         await gpt_service.add_gpt_message_with_code(gpt_message)
         if data['type'] == 'coin_swap':  # 如果是兑换类型，存库时候需要加一个过期字段，前端用于判断不再发起交易
             data['expired'] = True
-        messageContent = json.dumps(data)
+        if not data.get('code'):
+            data['code'] = generate_unique_id()
+        messageContent = json_utils.dumps(data, ensure_ascii=True)
         gpt_message = (
             messageContent,
             data['type'],
@@ -236,7 +474,42 @@ async def  getAnswerAndCallGpt(question, userid, msggroup, language, front_messa
         )
         await gpt_service.add_gpt_message_with_code(gpt_message)
 
-    
+
+def _on_stream_truncated(question, userid, msggroup, question_code, device_no, data, partial_text, code, upstream):
+    chat_stream_metrics.incr("truncated_streams")
+    if upstream is not None:
+        # 上游还没生成完的部分按 max_tokens 上限估算
+        chat_stream_metrics.incr("saved_tokens_est", max(max_tokens - count_tokens(partial_text, "gpt-3.5-turbo-16k"), 0))
+    logger.info(f'>>>>> client disconnected, partial answer: {len(partial_text)} chars')
+    if not partial_text:
+        return
+    data = dict(data) if data else {'type': 'gpt'}
+    data['content'] = partial_text
+    data['truncated'] = True
+    if code and not data.get('code'):
+        data['code'] = code
+    # 当前 task 已被取消或正在关闭，存库放到单独的 task 里
+    asyncio.ensure_future(save_chat_messages(question, userid, msggroup, question_code, device_no, data))
+
+
+async def close_upstream_streams(*streams):
+    # 关闭 openai 的流式响应，释放上游连接，不再继续生成
+    for stream in streams:
+        if stream is None:
+            continue
+        try:
+            await stream.aclose()
+        except Exception as e:
+            logger.error(f'close upstream stream error {e}')
+
+
+def _code_frame(_code, resume_token=None, status=None):
+    frame = {"code": _code}
+    if resume_token:
+        frame["resume_token"] = resume_token
+    if status:
+        frame["status"] = status
+    return json_utils.dumps(frame)
 
 
 def generate_unique_id():
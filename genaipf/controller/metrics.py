@@ -0,0 +1,8 @@
+from sanic import Request
+from genaipf.interfaces.common_response import success
+from genaipf.utils.metrics_utils import snapshot_all
+
+
+# 查询本 worker 进程内的性能指标
+async def get_metrics(request: Request):
+    return success(snapshot_all())
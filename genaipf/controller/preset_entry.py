@@ -17,6 +17,11 @@ preset_entry_mapping = {
         "sub_names": ["get_current_weather"],
         "param_names": ["location", "unit", "language", "subtype"],
         "get_and_pick": getAndPickSampleData,
+        # 可选：get_and_pick 结果缓存，ttl / stale_ttl 单位秒，key_params 默认是全部 param_names
+        "cache": {"ttl": 60, "stale_ttl": 300, "key_params": ["location", "unit", "language"], "refresh": False},
+        # 可选：数据本身就是回答时不调用第二轮模型，直接按语言渲染模板（字段来自函数参数、presetContent 和 picked_content）
+        # "answer_mode": "direct",
+        # "answer_template": {"en": "{location}: {temperature} {unit}", "zh": "{location}当前气温 {temperature} {unit}"},
     }
 }
 
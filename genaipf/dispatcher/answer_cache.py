@@ -0,0 +1,126 @@
+import time
+import uuid
+from genaipf.conf.answer_cache_conf import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIM_TH,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_EXCLUDED_FUNCS,
+)
+from genaipf.dispatcher.utils import aclient, models, answer_cache_coll_name, dimension
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+# 每写入多少条清理一次过期条目
+EVICT_EVERY_N_PUTS = 100
+
+
+class SemanticAnswerCache:
+    '''
+    文本模式回答的语义缓存，和 QA 集合一样存在 qdrant 里
+    key: 最新问题的 embedding + 语言 + 模型 + 本轮筛选出的函数集合
+    '''
+    def __init__(self, enabled=ANSWER_CACHE_ENABLED, sim_th=ANSWER_CACHE_SIM_TH, ttl=ANSWER_CACHE_TTL):
+        self.enabled = enabled
+        self.sim_th = sim_th
+        self.ttl = ttl
+        self._collection_ready = False
+        self._puts = 0
+        self.metrics = get_metrics("answer_cache")
+
+    def is_cacheable(self, used_gpt_functions, preset_entry_mapping):
+        if not self.enabled:
+            return False
+        for func in used_gpt_functions:
+            func_name = func["name"].split("_____")[0]
+            if func_name in ANSWER_CACHE_EXCLUDED_FUNCS:
+                return False
+            if not preset_entry_mapping.get(func_name, {}).get("answer_cache", True):
+                return False
+        return True
+
+    @staticmethod
+    def functions_key(used_gpt_functions):
+        return ",".join(sorted(func["name"] for func in used_gpt_functions))
+
+    async def _ensure_collection(self):
+        if self._collection_ready:
+            return
+        resp = await aclient.collections_api.get_collections()
+        if answer_cache_coll_name not in [x.name for x in resp.result.collections]:
+            await aclient.collections_api.create_collection(
+                collection_name=answer_cache_coll_name,
+                create_collection=models.CreateCollection(
+                    vectors=models.VectorParams(size=dimension, distance=models.Distance.COSINE)
+                ),
+            )
+        self._collection_ready = True
+
+    def _filter(self, language, model, funcs_key):
+        return models.Filter(must=[
+            models.FieldCondition(key="language", match=models.MatchValue(value=language)),
+            models.FieldCondition(key="model", match=models.MatchValue(value=model)),
+            models.FieldCondition(key="functions", match=models.MatchValue(value=funcs_key)),
+            models.FieldCondition(key="created_at", range=models.Range(gte=time.time() - self.ttl)),
+        ])
+
+    async def get(self, vector, language, model, funcs_key):
+        try:
+            await self._ensure_collection()
+            resp = await aclient.points_api.search_points(
+                collection_name=answer_cache_coll_name,
+                search_request=models.SearchRequest(
+                    vector=vector,
+                    filter=self._filter(language, model, funcs_key),
+                    limit=1,
+                    with_payload=True,
+                    score_threshold=self.sim_th,
+                ),
+            )
+        except Exception as e:
+            logger.error(f'SemanticAnswerCache get error {e}')
+            self.metrics.incr("error")
+            return None
+        if not resp.result:
+            self.metrics.incr("miss")
+            return None
+        self.metrics.incr("hit")
+        return resp.result[0].payload["answer"]
+
+    async def put(self, vector, question, answer, language, model, funcs_key):
+        try:
+            await self._ensure_collection()
+            payload = {
+                "question": question,
+                "answer": answer,
+                "language": language,
+                "model": model,
+                "functions": funcs_key,
+                "created_at": time.time(),
+            }
+            await aclient.points_api.upsert_points(
+                collection_name=answer_cache_coll_name,
+                wait=False,
+                point_insert_operations=models.PointsList(points=[
+                    models.PointStruct(id=str(uuid.uuid4()), vector=vector, payload=payload)
+                ]),
+            )
+            self.metrics.incr("put")
+            self._puts += 1
+            if self._puts % EVICT_EVERY_N_PUTS == 0:
+                await self.evict_expired()
+        except Exception as e:
+            logger.error(f'SemanticAnswerCache put error {e}')
+            self.metrics.incr("error")
+
+    async def evict_expired(self):
+        await aclient.points_api.delete_points(
+            collection_name=answer_cache_coll_name,
+            wait=False,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="created_at", range=models.Range(lt=time.time() - self.ttl)),
+            ])),
+        )
+        self.metrics.incr("evict_run")
+
+
+answer_cache = SemanticAnswerCache()
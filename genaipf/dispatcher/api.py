@@ -3,7 +3,14 @@ from genaipf.dispatcher.utils import openai
 from genaipf.utils.log_utils import logger
 from datetime import datetime
 from genaipf.dispatcher.prompts_v001 import LionPrompt
-from openai.error import InvalidRequestError
+from genaipf.dispatcher.context_window import fit_messages, count_prompt_tokens
+from genaipf.dispatcher.tokenizer import run_offloaded
+from genaipf.dispatcher.openai_transport import bind_openai_session, request_timeout
+from genaipf.dispatcher.scheduler import acquire_llm_slot, get_scheduler, lane_for_model
+from genaipf.dispatcher.stream_dedup import dedup_stream
+from genaipf.constant.error_code import ERROR_CODE
+from genaipf.exception.customer_exception import CustomerError
+from openai.error import InvalidRequestError, RateLimitError
 
 
 # temperature=2 # 值在[0,1]之间，越大表示回复越具有不确定性
@@ -17,6 +24,53 @@ top_p=0.85 # 过滤掉低于阈值的 token 确保结果不散漫
 frequency_penalty=0.3 # [-2,2]之间，该值越大则更倾向于产生不同的内容
 presence_penalty=0.2 # [-2,2]之间，该值越大则更倾向于产生不同的内容
 
+def _size_hint(messages, picked_content, related_qa):
+    # 估算这次请求要分词的字符数
+    size = len(picked_content) + sum(len(x) for x in related_qa)
+    for x in messages:
+        size += len(x.get("content") or "")
+    return size
+
+async def _open_chat_stream(payload, prompt_tokens, lane):
+    '''打开 ChatCompletion 流：相同 payload 正在生成时直接订阅已有的流，否则排队等配额后请求上游'''
+    async def _open():
+        # 排队等上游配额，先按 prompt + max_tokens 预扣 TPM，结束后按实际输出退回多扣的部分
+        model = payload["model"]
+        await acquire_llm_slot(model, prompt_tokens, payload["max_tokens"], lane)
+        bind_openai_session()
+        try:
+            response = await openai.ChatCompletion.acreate(**payload, stream=True, request_timeout=request_timeout)
+        except Exception as e:
+            get_scheduler(model).refund(prompt_tokens + payload["max_tokens"])
+            # 只在真正请求上游的地方报告 429，共享这个流的订阅者不会重复报告
+            if isinstance(e, RateLimitError):
+                get_scheduler(model).report_rate_limited(_retry_after(e))
+            raise
+        get_scheduler(model).report_ok()
+        return _metered_stream(response, model, payload["max_tokens"])
+    return await dedup_stream(payload, _open)
+
+async def _metered_stream(stream, model, max_tokens):
+    '''流式响应没有 usage，按输出的 chunk 数（每个 chunk 约一个 token）估算实际用量，流结束或关闭时退回没用到的 max_tokens'''
+    used = 0
+    try:
+        async for chunk in stream:
+            used += 1
+            yield chunk
+    finally:
+        get_scheduler(model).refund(max_tokens - used)
+        try:
+            await stream.aclose()
+        except Exception as e:
+            logger.error(f'close upstream stream error {e}')
+
+def _retry_after(e):
+    # 429 响应里的 Retry-After（秒），没有或解析不了时返回 None
+    try:
+        return float(e.headers.get("retry-after") or e.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
 async def afunc_gpt4_generator(messages, functions=gpt_functions, language=LionPrompt.default_lang, model='', picked_content="", related_qa=[]):
     '''
     "messages": [
@@ -28,17 +82,22 @@ async def afunc_gpt4_generator(messages, functions=gpt_functions, language=LionP
     use_model = 'gpt-3.5-turbo-16k'
     if model == 'ml-plus':
         use_model = 'gpt-4'
+    bind_openai_session()
     for i in range(5):
         mlength = len(messages)
         try:
+            # 参考资料很长时 prompt 拼接（含分词截断）和 token 计数放到线程池里做
+            size_hint = _size_hint(messages, picked_content, related_qa)
             system = {
                 "role": "system",
-                "content": LionPrompt.get_afunc_prompt(language, picked_content, related_qa, use_model)
+                "content": await run_offloaded(size_hint, LionPrompt.get_afunc_prompt, language, picked_content, related_qa, use_model)
             }
             # messages.insert(0, system)
+            # 按上下文窗口预先裁剪历史，尽量一次请求成功
+            messages = await run_offloaded(size_hint, fit_messages, system, messages, use_model, max_tokens, functions)
             _messages = [system] + messages
             # print(f'>>>>>test 004 : {_messages}')
-            response = await openai.ChatCompletion.acreate(
+            payload = dict(
                 model=use_model,
                 messages=_messages,
                 functions=functions,
@@ -47,35 +106,43 @@ async def afunc_gpt4_generator(messages, functions=gpt_functions, language=LionP
                 top_p=top_p, # 过滤掉低于阈值的 token 确保结果不散漫
                 frequency_penalty=frequency_penalty,  # [-2,2]之间，该值越大则更倾向于产生不同的内容
                 presence_penalty=presence_penalty,  # [-2,2]之间，该值越大则更倾向于产生不同的内容
-                stream=True
             )
+            response = await _open_chat_stream(payload, count_prompt_tokens(system, messages, use_model, functions), lane_for_model(model))
             print('afunc_gpt4_generator called')
             return response
         except InvalidRequestError as e:
             print(e)
             logger.error(f'afunc_gpt4_generator InvalidRequestError {e}', e)
             messages = messages[mlength // 2:]
+        except RateLimitError as e:
+            # 429 已经在 _open_chat_stream 里报告过，重试前 acquire 会先等退避结束
+            logger.error(f'afunc_gpt4_generator RateLimitError {e}', e)
         except Exception as e:
             print(e)
             logger.error(f'afunc_gpt4_generator question_JSON call gpt4 error {e}', e)
             raise e
+    # 重试都失败了，返回繁忙而不是 None，前端会收到 [ERROR] 帧
+    raise CustomerError(status_code=ERROR_CODE['SERVER_BUSY'])
 
 
 async def aref_answer_gpt_generator(messages, model='', language=LionPrompt.default_lang, preset_name=None, picked_content="", related_qa=[]):
     use_model = 'gpt-3.5-turbo-16k'
     if model == 'ml-plus':
         use_model = 'gpt-4'
+    bind_openai_session()
     for i in range(5):
         mlength = len(messages)
         try:
+            size_hint = _size_hint(messages, picked_content, related_qa)
             system = {
                 "role": "system",
-                "content": LionPrompt.get_aref_answer_prompt(language, preset_name, picked_content, related_qa, use_model)
+                "content": await run_offloaded(size_hint, LionPrompt.get_aref_answer_prompt, language, preset_name, picked_content, related_qa, use_model)
             }
             # messages.insert(0, system)
             # print(f'>>>>>test 003 : {messages}')
+            messages = await run_offloaded(size_hint, fit_messages, system, messages, use_model, max_tokens)
             _messages = [system] + messages
-            response = await openai.ChatCompletion.acreate(
+            payload = dict(
                 model=use_model,
                 messages=_messages,
                 temperature=temperature,  # 值在[0,1]之间，越大表示回复越具有不确定性
@@ -83,14 +150,21 @@ async def aref_answer_gpt_generator(messages, model='', language=LionPrompt.defa
                 top_p=top_p, # 过滤掉低于阈值的 token 确保结果不散漫
                 frequency_penalty=frequency_penalty,  # [-2,2]之间，该值越大则更倾向于产生不同的内容
                 presence_penalty=presence_penalty,  # [-2,2]之间，该值越大则更倾向于产生不同的内容
-                stream=True
             )
+            response = await _open_chat_stream(payload, count_prompt_tokens(system, messages, use_model), lane_for_model(model))
             print(f'aref_answer_gpt called')
             return response
         except InvalidRequestError as e:
             print(e)
             logger.error(f'aref_answer_gpt_generator InvalidRequestError {e}', e)
             messages = messages[mlength // 2:]
+        except CustomerError as e:
+            raise e
+        except RateLimitError as e:
+            # 429 已经在 _open_chat_stream 里报告过，重试前 acquire 会先等退避结束
+            logger.error(f'aref_answer_gpt_generator RateLimitError {e}', e)
         except Exception as e:
             print(e)
             logger.error(f'aref_answer_gpt_generator question_JSON call gpt4 error {e}', e)
+    # 重试都失败了，返回繁忙而不是 None，前端会收到 [ERROR] 帧
+    raise CustomerError(status_code=ERROR_CODE['SERVER_BUSY'])
@@ -0,0 +1,96 @@
+import json
+from genaipf.constant.error_code import ERROR_CODE
+from genaipf.dispatcher.tokenizer import count_tokens, truncate_tokens
+from genaipf.exception.customer_exception import CustomerError
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+# 各模型的上下文窗口大小（token）
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+# 每条消息的格式开销，以及回复开头的 3 个 token
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_REPLY_PRIMING = 3
+# 当前问题截断后至少保留的 token 数，再少就没有意义了
+MIN_QUESTION_TOKENS = 32
+
+metrics = get_metrics("context_window")
+
+
+def count_text_tokens(text, model):
+    return count_tokens(text, model)
+
+
+def count_message_tokens(message, model):
+    num = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        if key == "function_call" and value:
+            num += count_text_tokens(value.get("name"), model) + count_text_tokens(value.get("arguments"), model)
+        elif isinstance(value, str):
+            num += count_text_tokens(value, model)
+            if key == "name":
+                num += TOKENS_PER_NAME
+    return num
+
+
+def count_functions_tokens(functions, model):
+    # 函数定义在服务端会被改写成另一种格式，这里用 json 长度做近似
+    if not functions:
+        return 0
+    return count_text_tokens(json.dumps(functions, ensure_ascii=False), model)
+
+
+def count_prompt_tokens(system, messages, model, functions=None):
+    # 一次请求的 prompt token 数，供限流估算用
+    return (TOKENS_REPLY_PRIMING + count_message_tokens(system, model) + count_functions_tokens(functions, model)
+            + sum(count_message_tokens(x, model) for x in messages))
+
+
+def fit_messages(system, messages, model, max_tokens, functions=None):
+    '''
+    按模型上下文窗口裁剪历史消息，保证一次请求就能放下：
+    system prompt（含参考资料）、函数定义、回复的 max_tokens 先占预算，
+    最新一条用户消息（当前问题）一定保留，放不下时截断其内容；剩下的从新到旧保留
+    当前问题连 MIN_QUESTION_TOKENS 都放不下时抛出 CONTEXT_TOO_LONG
+    返回保留的消息
+    '''
+    limit = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    budget = limit - max_tokens - TOKENS_REPLY_PRIMING - count_message_tokens(system, model) - count_functions_tokens(functions, model)
+    if not messages:
+        return []
+    question_index = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get("role") == "user"), len(messages) - 1)
+    question = messages[question_index]
+    n = count_message_tokens(question, model)
+    dropped = 0
+    if n > budget:
+        if not isinstance(question.get("content"), str) or budget - TOKENS_PER_MESSAGE < MIN_QUESTION_TOKENS:
+            metrics.incr("context_too_long")
+            logger.error(f'fit_messages {model} question does not fit, budget {budget}')
+            raise CustomerError(status_code=ERROR_CODE['CONTEXT_TOO_LONG'])
+        # 当前问题单独都放不下，只保留开头部分
+        content = truncate_tokens(question["content"], model, budget - TOKENS_PER_MESSAGE)
+        question = {**question, "content": content}
+        dropped += n - count_message_tokens(question, model)
+        n = count_message_tokens(question, model)
+    budget -= n
+    kept = {question_index: question}
+    for i in range(len(messages) - 1, -1, -1):
+        if i == question_index:
+            continue
+        n = count_message_tokens(messages[i], model)
+        if n > budget:
+            dropped += sum(count_message_tokens(x, model) for j, x in enumerate(messages[:i + 1]) if j != question_index)
+            break
+        kept[i] = messages[i]
+        budget -= n
+    if dropped:
+        metrics.incr("trimmed_requests")
+        metrics.incr("dropped_tokens", dropped)
+        logger.info(f'fit_messages {model} dropped {dropped} tokens, kept {len(kept)}/{len(messages)} messages')
+    return [kept[i] for i in sorted(kept)]
@@ -7,7 +7,17 @@ from genaipf.dispatcher.utils import (
     client,
     models,
     get_embedding,
+    get_embeddings,
+    local_vdb_coll_names,
+    dimension,
+    embedding_provider,
 )
+from genaipf.dispatcher.local_vdb import LocalVectorIndex
+from genaipf.dispatcher.embedding_cache import content_hash, embedding_cache
+from genaipf.dispatcher.embedding_store import EmbeddingStore
+from genaipf.conf.vdb_conf import VDB_SYNC_EMBED_BATCH_SIZE, VDB_SYNC_CONCURRENCY, VDB_SYNC_UPSERT_CHUNK
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import tqdm
 
 
@@ -15,7 +25,6 @@ import tqdm
 
 # # collection_name = qa_coll_name
 # collection_name = gpt_func_coll_name
-dimension = 1536
 
 def update_vdb(collection_name):
     if collection_name == qa_coll_name:
@@ -32,29 +41,99 @@ def update_vdb(collection_name):
             ),
         )
 
-    # ======= 把 vdb_map 新增的内容加到向量数据库 START =======
-    all_data = client.scroll(collection_name, limit=10000)
-    ids = [record.id for record in all_data[0]]
-    max_id = 0 if not ids else max(ids)
+    # ======= 把 vdb_map 同步到向量数据库 START =======
+    # 按内容哈希比对：新增的 q 做 embedding 后写入，a 变化的只更新 payload，vdb_map 里已删除的 q 从库里删掉
+    existing = {}
+    duplicated_ids = []
+    max_id = 0
+    for record in scroll_all(collection_name):
+        max_id = max(max_id, record.id)
+        q_hash = content_hash(record.payload["q"])
+        if q_hash in existing:
+            duplicated_ids.append(record.id)
+        else:
+            existing[q_hash] = (record.id, _answer_hash(record.payload.get("a")))
+    wanted = {content_hash(q): q for q in vdb_map.keys()}
+
+    inc_texts = [q for q_hash, q in wanted.items() if q_hash not in existing]
+    changed = [(existing[q_hash][0], q) for q_hash, q in wanted.items()
+               if q_hash in existing and existing[q_hash][1] != _answer_hash(vdb_map[q])]
+    removed_ids = [point_id for q_hash, (point_id, _) in existing.items() if q_hash not in wanted] + duplicated_ids
+    print(f'>>>>> {collection_name}: {len(inc_texts)} new, {len(changed)} changed, {len(removed_ids)} removed')
+
+    # a 变化的点连同已有向量按块 upsert，不逐个 set_payload
+    for i in tqdm.tqdm(range(0, len(changed), VDB_SYNC_UPSERT_CHUNK), desc="payload"):
+        chunk = dict(changed[i:i + VDB_SYNC_UPSERT_CHUNK])
+        records = client.retrieve(collection_name, ids=list(chunk), with_payload=False, with_vectors=True)
+        points = [
+            {"id": record.id, "vector": record.vector, "payload": {"q": chunk[record.id], "a": vdb_map[chunk[record.id]]}}
+            for record in records
+        ]
+        client.upsert(collection_name, points)
+    for i in range(0, len(removed_ids), VDB_SYNC_UPSERT_CHUNK):
+        client.delete(collection_name, points_selector=models.PointIdsList(points=removed_ids[i:i + VDB_SYNC_UPSERT_CHUNK]))
+
+    # 分批 embedding（有限并发），每批算完立即写入；中途中断后重跑只会处理还没写入的部分
+    batches = []
     id_cur = max_id + 1
-    existing_texts = [record.payload["q"] for record in all_data[0]]
-    inc_texts = [x for x in vdb_map.keys() if x not in existing_texts]
-    tobe_vectors = []
-    for text in tqdm.tqdm(inc_texts):
-        emb_v = get_embedding(text)
-        vector_dict = {
-            "id": id_cur,
-            "vector": emb_v,
-            "payload": {"q": text, "a": vdb_map[text]},
-        }
-        tobe_vectors.append(vector_dict)
-        id_cur += 1
-    if tobe_vectors:
-        client.upsert(collection_name, tobe_vectors)
-    # ======= 把 vdb_map 新增的内容加到向量数据库 END =======
-
-def update_all_vdb():
+    for i in range(0, len(inc_texts), VDB_SYNC_EMBED_BATCH_SIZE):
+        texts = inc_texts[i:i + VDB_SYNC_EMBED_BATCH_SIZE]
+        batches.append((list(range(id_cur, id_cur + len(texts))), texts))
+        id_cur += len(texts)
+
+    def embed_and_upsert(ids, texts):
+        vectors = get_embeddings(texts)
+        points = [
+            {"id": point_id, "vector": emb_v, "payload": {"q": text, "a": vdb_map[text]}}
+            for point_id, text, emb_v in zip(ids, texts, vectors)
+        ]
+        for j in range(0, len(points), VDB_SYNC_UPSERT_CHUNK):
+            client.upsert(collection_name, points[j:j + VDB_SYNC_UPSERT_CHUNK])
+        return len(points)
+
+    with ThreadPoolExecutor(max_workers=VDB_SYNC_CONCURRENCY) as pool:
+        futures = [pool.submit(embed_and_upsert, ids, texts) for ids, texts in batches]
+        with tqdm.tqdm(total=len(inc_texts), desc="embedding") as progress:
+            for future in as_completed(futures):
+                progress.update(future.result())
+    # ======= 把 vdb_map 同步到向量数据库 END =======
+    return list(wanted.values())
+
+def _answer_hash(answer):
+    return content_hash(json.dumps(answer, sort_keys=True, ensure_ascii=False))
+
+def scroll_all(collection_name, with_vectors=False, page_size=1000):
+    offset = None
+    while True:
+        records, offset = client.scroll(collection_name, limit=page_size, offset=offset, with_payload=True, with_vectors=with_vectors)
+        for record in records:
+            yield record
+        if offset is None:
+            break
+
+def build_local_vdb(collection_name):
+    # 直接复用 qdrant 里已有的向量生成本地 mmap 索引，不需要重新调 embedding
+    vectors = []
+    payloads = []
+    for record in scroll_all(collection_name, with_vectors=True):
+        vectors.append(record.vector)
+        payloads.append(record.payload)
+    LocalVectorIndex.build(collection_name, vectors, payloads)
+    print(f'>>>>> build local vdb {collection_name}: {len(payloads)} vectors')
+
+def update_all_vdb(compact_store=True):
+    # 离线建库时挂载可写的磁盘 embedding 库，已经算过的向量不再调接口
+    store = EmbeddingStore(dimension=dimension)
+    embedding_cache.attach_store(store)
+    live_texts = []
     for collection_name in [qa_coll_name, gpt_func_coll_name]:
         print(f'>>>>> update vdb {collection_name} start.')
-        update_vdb(collection_name)
-        print(f'>>>>> update vdb {collection_name} end.')
\ No newline at end of file
+        live_texts += update_vdb(collection_name)
+        if collection_name in local_vdb_coll_names:
+            build_local_vdb(collection_name)
+        print(f'>>>>> update vdb {collection_name} end.')
+    if compact_store:
+        # 只保留现在各个 collection 里还在用的文本的向量
+        model = embedding_provider.model
+        store.compact(keep_keys={(model, content_hash(text)) for text in live_texts})
+    print(f'>>>>> embedding store: {store.stats()}')
\ No newline at end of file
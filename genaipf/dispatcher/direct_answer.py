@@ -0,0 +1,45 @@
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+metrics = get_metrics("direct_answer")
+# 模板里没有当前语言时用的语言
+DEFAULT_TEMPLATE_LANG = "en"
+
+
+class _TemplateValues(dict):
+    # 模板里引用了数据中没有的字段时渲染成空字符串
+    def __missing__(self, key):
+        return ""
+
+
+def render_direct_answer(preset_conf, language, presetContent, picked_content, param):
+    '''
+    preset entry 声明 "answer_mode": "direct" 时，不再调用第二轮模型，直接用模板渲染回答：
+    "answer_template": {语言: 模板} 用 str.format_map 渲染，可用字段是函数参数、presetContent 的字段和 picked_content；
+    也可以是函数 f(presetContent, picked_content, language, param) 返回字符串
+    没有可用模板或渲染失败时返回 None，调用方走原来的模型回答
+    '''
+    if preset_conf.get("answer_mode") != "direct":
+        return None
+    template = preset_conf.get("answer_template")
+    try:
+        if callable(template):
+            text = template(presetContent, picked_content, language, param)
+        else:
+            template = (template or {}).get(language) or (template or {}).get(DEFAULT_TEMPLATE_LANG)
+            if template is None:
+                metrics.incr("no_template")
+                return None
+            values = _TemplateValues(param)
+            if isinstance(presetContent, dict):
+                values.update(presetContent)
+            values["picked_content"] = picked_content
+            text = template.format_map(values)
+    except Exception as e:
+        metrics.incr("render_error")
+        logger.error(f'render direct answer {preset_conf.get("name")} error {e}')
+        return None
+    if not text:
+        return None
+    metrics.incr("rendered")
+    return text
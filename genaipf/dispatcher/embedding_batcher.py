@@ -0,0 +1,77 @@
+import asyncio
+from genaipf.conf.embedding_conf import EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_WAIT_MS
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+
+class EmbeddingBatcher:
+    '''
+    把同一时间窗口内所有请求的 embedding 调用合并成一次 input=[...] 调用
+    单批达到 max_batch_size 立即发送，否则最多等待 max_wait_ms
+    '''
+    def __init__(self, provider, max_batch_size=EMBEDDING_BATCH_MAX_SIZE, max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        # 正在发送的批次，保留引用避免 task 被回收
+        self._tasks = set()
+        self.metrics = get_metrics("embedding_batcher")
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._on_send_done)
+
+    def _on_send_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # _send 自己会把异常交给每个等待者，这里只是取走异常避免 "exception was never retrieved"
+            logger.error(f'EmbeddingBatcher send task error {task.exception()}')
+
+    async def _send(self, batch):
+        # 同一批里的重复文本只请求一次
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.metrics.incr("batches")
+        self.metrics.incr("texts", len(batch))
+        self.metrics.incr("unique_texts", len(texts))
+        self.metrics.observe("batch_fill", len(batch) / self.max_batch_size)
+        try:
+            vectors = dict(zip(texts, await self.provider.aembed(texts)))
+            for text, fut in batch:
+                if not fut.done():
+                    fut.set_result(vectors[text])
+        except Exception as e:
+            self.metrics.incr("errors")
+            logger.error(f'EmbeddingBatcher call embedding error {e}')
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+
+
+_batchers = {}
+
+
+def get_embedding_batcher(provider):
+    batcher = _batchers.get(provider.model)
+    if batcher is None:
+        batcher = EmbeddingBatcher(provider)
+        _batchers[provider.model] = batcher
+    return batcher
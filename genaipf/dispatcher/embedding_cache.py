@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from genaipf.conf.embedding_conf import EMBEDDING_L1_MAX_BYTES, EMBEDDING_L2_ENABLED, EMBEDDING_L2_TTL
+from genaipf.constant.redis_keys import REDIS_KEYS
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+from genaipf.utils.redis_utils import RedisBinaryConnectionPool
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(data):
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+# 进程内 LRU，按打包后向量的字节数限制容量
+class LRUByteCache:
+    def __init__(self, max_bytes=EMBEDDING_L1_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = get_metrics("embedding_cache_l1")
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.metrics.incr("miss")
+                return None
+            self._data.move_to_end(key)
+        self.metrics.incr("hit")
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+                self.metrics.incr("evict")
+        self.metrics.set("bytes", self.size)
+        self.metrics.set("items", len(self._data))
+
+
+# 各 worker 共享的 Redis 缓存，读写失败时按未命中处理
+class RedisEmbeddingCache:
+    def __init__(self, ttl=EMBEDDING_L2_TTL):
+        self.ttl = ttl
+        self.metrics = get_metrics("embedding_cache_l2")
+
+    def get(self, key):
+        try:
+            redis_client = RedisBinaryConnectionPool().get_connection()
+            data = redis_client.get(REDIS_KEYS['EMBEDDING_KEYS']['EMBEDDING'].format(*key))
+        except Exception as e:
+            logger.error(f'RedisEmbeddingCache get error {e}')
+            self.metrics.incr("error")
+            return None
+        if data is None:
+            self.metrics.incr("miss")
+            return None
+        self.metrics.incr("hit")
+        return data
+
+    def put(self, key, data):
+        try:
+            redis_client = RedisBinaryConnectionPool().get_connection()
+            redis_client.set(REDIS_KEYS['EMBEDDING_KEYS']['EMBEDDING'].format(*key), data, self.ttl)
+        except Exception as e:
+            logger.error(f'RedisEmbeddingCache put error {e}')
+            self.metrics.incr("error")
+
+
+class TieredEmbeddingCache:
+    '''
+    L1 进程内 LRU + L2 Redis，key 为 (模型名, 文本内容哈希)，值为 float32 打包字节
+    L2 命中时回填 L1；挂载了磁盘 embedding 库（EmbeddingStore）时作为最后一级
+    '''
+    def __init__(self, l2_enabled=EMBEDDING_L2_ENABLED):
+        self.l1 = LRUByteCache()
+        self.l2 = RedisEmbeddingCache() if l2_enabled else None
+        self.store = None
+
+    def attach_store(self, store):
+        self.store = store
+
+    def get(self, text, model):
+        key = (model, content_hash(text))
+        data = self.l1.get(key)
+        if data is None:
+            data = self._get_lower(text, model, key)
+        if data is None:
+            return None
+        return unpack_vector(data)
+
+    def _get_lower(self, text, model, key):
+        # L1 未命中后查 L2 和磁盘库，命中时回填上面几级
+        data = None
+        if self.l2 is not None:
+            data = self.l2.get(key)
+            if data is not None:
+                self.l1.put(key, data)
+                if self.store is not None:
+                    self.store.put(text, model, unpack_vector(data))
+        if data is None and self.store is not None:
+            vector = self.store.get(text, model)
+            if vector is not None:
+                data = pack_vector(vector)
+                self.l1.put(key, data)
+                if self.l2 is not None:
+                    self.l2.put(key, data)
+        return data
+
+    def put(self, text, model, vector):
+        key = (model, content_hash(text))
+        data = pack_vector(vector)
+        self.l1.put(key, data)
+        self._put_lower(text, model, key, data, vector)
+
+    def _put_lower(self, text, model, key, data, vector):
+        if self.l2 is not None:
+            self.l2.put(key, data)
+        if self.store is not None:
+            self.store.put(text, model, vector)
+
+    async def aget(self, text, model):
+        '''异步版本：L1 在事件循环里查，L2（同步 redis）和磁盘库放到线程池里查'''
+        key = (model, content_hash(text))
+        data = self.l1.get(key)
+        if data is None and (self.l2 is not None or self.store is not None):
+            data = await asyncio.get_running_loop().run_in_executor(None, self._get_lower, text, model, key)
+        if data is None:
+            return None
+        return unpack_vector(data)
+
+    async def aput(self, text, model, vector):
+        key = (model, content_hash(text))
+        data = pack_vector(vector)
+        self.l1.put(key, data)
+        if self.l2 is None and self.store is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._put_lower, text, model, key, data, vector)
+
+
+embedding_cache = TieredEmbeddingCache()
@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import re
+from abc import abstractmethod
+import numpy as np
+import openai
+from genaipf.conf.embedding_conf import EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_LOCAL_MODEL
+from genaipf.dispatcher.openai_transport import bind_openai_session, request_timeout
+
+
+class EmbeddingProvider:
+    # model 同时作为 embedding 缓存 key 的一部分，不同 provider 的向量不会混用
+    model = ""
+    dimension = 1536
+
+    @abstractmethod
+    def embed(self, texts):
+        ...
+
+    async def aembed(self, texts):
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed, texts)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    dimension = 1536
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.model = model
+
+    @staticmethod
+    def _unpack(result):
+        return [item["embedding"] for item in sorted(result["data"], key=lambda x: x["index"])]
+
+    def embed(self, texts):
+        return self._unpack(openai.Embedding.create(model=self.model, input=texts))
+
+    async def aembed(self, texts):
+        bind_openai_session()
+        return self._unpack(await openai.Embedding.acreate(model=self.model, input=texts, request_timeout=request_timeout))
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    '''
+    不联网的确定性 embedding：词和字符三元组哈希到 1536 维（带符号）再归一化
+    只用于压测、benchmark 和离线开发，语义效果远不如真实模型
+    '''
+    _word_re = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dimension=1536):
+        self.dimension = dimension
+        self.model = f"local-hashing-{dimension}"
+
+    def _features(self, text):
+        text = text.lower()
+        features = self._word_re.findall(text)
+        compact = "".join(text.split())
+        features += [compact[i:i + 3] for i in range(max(len(compact) - 2, 0))]
+        return features
+
+    def _embed_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dimension] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
+
+    async def aembed(self, texts):
+        return self.embed(texts)
+
+
+class SentenceTransformerEmbeddingProvider(EmbeddingProvider):
+    '''本地 sentence-transformers 模型，需要另外安装 sentence-transformers'''
+    def __init__(self, model_name=EMBEDDING_LOCAL_MODEL):
+        self.model_name = model_name
+        self.model = f"st-{model_name}"
+        self._encoder = None
+
+    def _get_encoder(self):
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.model_name)
+        return self._encoder
+
+    @property
+    def dimension(self):
+        return self._get_encoder().get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self._get_encoder().encode(list(texts), normalize_embeddings=True).tolist()
+
+
+embedding_provider_mapping = {
+    "openai": OpenAIEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+    "sentence_transformers": SentenceTransformerEmbeddingProvider,
+}
+
+_providers = {}
+
+
+def get_embedding_provider(name=EMBEDDING_PROVIDER):
+    provider = _providers.get(name)
+    if provider is None:
+        provider = embedding_provider_mapping[name]()
+        _providers[name] = provider
+    return provider
@@ -0,0 +1,197 @@
+import mmap
+import os
+import threading
+import time
+import numpy as np
+from genaipf.conf.embedding_conf import EMBEDDING_STORE_PATH
+from genaipf.dispatcher.embedding_cache import content_hash, pack_vector
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+
+class EmbeddingStore:
+    '''
+    磁盘上的 embedding 库，重建索引时复用已有向量，不再调 embedding 接口
+    embeddings[.{代}].f32: 只追加的 float32 文件，每条记录定长，用 mmap 读
+    embeddings[.{代}].idx: 只追加的索引，每行 "模型名\\t内容哈希\\t记录序号"
+    compact 每次写出新一代文件再原子替换指针文件 embeddings.current，
+    只读进程发现代号变了就整体重新加载，不会拿旧的记录序号去读新文件
+    '''
+    def __init__(self, path=EMBEDDING_STORE_PATH, dimension=1536, readonly=False):
+        self.path = path
+        self.dimension = dimension
+        self.readonly = readonly
+        self.record_size = dimension * 4
+        self.pointer_file = os.path.join(path, "embeddings.current")
+        self._generation = None
+        self._index = {}
+        self._index_size = 0
+        self._mm = None
+        self._mm_records = 0
+        self._lock = threading.Lock()
+        self.metrics = get_metrics("embedding_store")
+        self._switch(self._current_generation())
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+            for f in (self.data_file, self.index_file):
+                open(f, "ab").close()
+            self._truncate_torn_record()
+        self._load_index()
+
+    def _truncate_torn_record(self):
+        # 上次写入中途被杀时数据文件末尾会有半条记录，截掉，后面的记录才能按 slot 对齐
+        size = os.path.getsize(self.data_file)
+        aligned = size // self.record_size * self.record_size
+        if aligned != size:
+            logger.error(f'EmbeddingStore truncate torn record {size} -> {aligned}')
+            with open(self.data_file, "r+b") as f:
+                f.truncate(aligned)
+
+    def _files(self, generation):
+        # 没有指针文件时（还没 compact 过）用不带代号的文件名
+        suffix = f".{generation}" if generation else ""
+        return os.path.join(self.path, f"embeddings{suffix}.f32"), os.path.join(self.path, f"embeddings{suffix}.idx")
+
+    def _current_generation(self):
+        try:
+            with open(self.pointer_file) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def _switch(self, generation):
+        # 换到另一代文件，已加载的索引和 mmap 全部作废
+        self._generation = generation
+        self.data_file, self.index_file = self._files(generation)
+        self._index = {}
+        self._index_size = 0
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self._mm_records = 0
+
+    def _records_on_disk(self):
+        if not os.path.exists(self.data_file):
+            return 0
+        return os.path.getsize(self.data_file) // self.record_size
+
+    def _load_index(self):
+        # 只读模式下代号变了就整体重新加载，否则索引文件变大（其他进程写入了）才增量读取新增的行
+        generation = self._current_generation()
+        if generation != self._generation:
+            self._switch(generation)
+        try:
+            size = os.path.getsize(self.index_file)
+            if size == self._index_size:
+                return
+            records = self._records_on_disk()
+            with open(self.index_file, "rb") as f:
+                f.seek(self._index_size)
+                chunk = f.read()
+        except FileNotFoundError:
+            # 还没有建库，或者读的这一代刚被 compact 删掉，下次再按指针加载
+            self._switch(None)
+            return
+        consumed = chunk.rfind(b"\n") + 1
+        for line in chunk[:consumed].decode("utf-8").splitlines():
+            model, h, slot = line.split("\t")
+            # 数据没写完整的记录（例如进程中途被杀）直接忽略
+            if int(slot) < records:
+                self._index[(model, h)] = int(slot)
+        self._index_size += consumed
+        self.metrics.set("items", len(self._index))
+
+    def _view(self, slot):
+        if slot >= self._mm_records:
+            if self._mm is not None:
+                self._mm.close()
+            with open(self.data_file, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mm_records = len(self._mm) // self.record_size
+        return np.frombuffer(self._mm, dtype=np.float32, count=self.dimension, offset=slot * self.record_size)
+
+    def _get(self, key):
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        try:
+            return self._view(slot).tolist()
+        except FileNotFoundError:
+            # 这一代文件已经被 compact 删掉，作废后按指针重新加载
+            self._switch(None)
+            return None
+
+    def get(self, text, model):
+        key = (model, content_hash(text))
+        with self._lock:
+            vector = self._get(key)
+            if vector is None and self.readonly:
+                self._load_index()
+                vector = self._get(key)
+        if vector is None:
+            self.metrics.incr("miss")
+            return None
+        self.metrics.incr("hit")
+        return vector
+
+    def put(self, text, model, vector):
+        if self.readonly:
+            return
+        key = (model, content_hash(text))
+        data = pack_vector(vector)
+        if len(data) != self.record_size:
+            logger.error(f'EmbeddingStore dimension mismatch {len(data) // 4} != {self.dimension}')
+            return
+        with self._lock:
+            if key in self._index:
+                return
+            with open(self.data_file, "r+b") as f:
+                # 按整条记录定位写入位置，末尾即使有写了一半的记录也会被覆盖
+                slot = f.seek(0, os.SEEK_END) // self.record_size
+                f.seek(slot * self.record_size)
+                f.write(data)
+            line = f"{key[0]}\t{key[1]}\t{slot}\n".encode("utf-8")
+            with open(self.index_file, "ab") as f:
+                f.write(line)
+            self._index[key] = slot
+            self._index_size += len(line)
+        self.metrics.incr("put")
+        self.metrics.set("items", len(self._index))
+
+    def compact(self, keep_keys=None):
+        '''
+        写出新一代数据和索引文件，去掉没有被索引引用的记录；
+        keep_keys 为 (模型名, 内容哈希) 集合时只保留其中的向量
+        '''
+        with self._lock:
+            items = sorted(self._index.items(), key=lambda kv: kv[1])
+            if keep_keys is not None:
+                items = [(key, slot) for key, slot in items if key in keep_keys]
+            if len(items) == self._records_on_disk() and all(slot == i for i, (_, slot) in enumerate(items)):
+                # 没有可以去掉的记录，不重写文件
+                self.metrics.incr("compact_skipped")
+                return
+            generation = str(time.time_ns())
+            data_file, index_file = self._files(generation)
+            with open(data_file, "wb") as data_f, open(index_file, "wb") as index_f:
+                for new_slot, (key, slot) in enumerate(items):
+                    data_f.write(self._view(slot).tobytes())
+                    index_f.write(f"{key[0]}\t{key[1]}\t{new_slot}\n".encode("utf-8"))
+            old_files = (self.data_file, self.index_file)
+            with open(self.pointer_file + ".tmp", "w") as f:
+                f.write(generation)
+            os.replace(self.pointer_file + ".tmp", self.pointer_file)
+            self._switch(generation)
+            # 已经 mmap 旧文件的只读进程不受删除影响，下次读到新指针时切换
+            for f in old_files:
+                if os.path.exists(f):
+                    os.remove(f)
+            self._load_index()
+        self.metrics.incr("compact")
+        self.metrics.set("items", len(self._index))
+
+    def stats(self):
+        data = self.metrics.snapshot()
+        data["items"] = len(self._index)
+        data["bytes"] = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        return data
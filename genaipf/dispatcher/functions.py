@@ -1,4 +1,5 @@
-from genaipf.dispatcher.utils import get_vdb_topk, gpt_func_coll_name
+from genaipf.dispatcher.utils import gpt_func_coll_name
+from genaipf.dispatcher.retrieval_context import RetrievalContext
 from genaipf.dispatcher.vdb_pairs.gpt_func import vdb_map
 from genaipf.utils.log_utils import logger
 
@@ -29,13 +30,16 @@ gpt_functions_mapping = {
 
 gpt_functions = list(gpt_functions_mapping.values())
 
-def gpt_function_filter(gpt_functions_mapping, messages, msg_k=5, v_n=5, per_n=2):
+async def gpt_function_filter(gpt_functions_mapping, messages, msg_k=5, v_n=5, per_n=2, retrieval_ctx=None):
     try:
+        if retrieval_ctx is None:
+            retrieval_ctx = RetrievalContext()
         user_messages = [msg['content'] for msg in messages if msg['role'] == 'user'][-msg_k:]
+        # 所有消息一次 search_batch 查完，相同文本在 retrieval_ctx 内只算一次
+        all_results = await retrieval_ctx.vdb_topk_batch(user_messages, gpt_func_coll_name, 0.1, v_n)
         used_names = set()
-        for text in user_messages:
+        for results in all_results:
             tmp_names = []
-            results = get_vdb_topk(text, gpt_func_coll_name, 0.1, v_n)
             for x in results:
                 _name = vdb_map.get(x["payload"]["q"])
                 if _name and _name not in tmp_names:
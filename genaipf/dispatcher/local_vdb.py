@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+from genaipf.conf.vdb_conf import LOCAL_VDB_PATH
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+# 检查索引文件是否被 create_vdb 重建的间隔（秒）
+RELOAD_CHECK_INTERVAL = 10
+
+
+class LocalVectorIndex:
+    '''
+    进程内向量索引：float32 矩阵（已按行归一化）以 mmap 方式打开，余弦相似度 top-k 用 numpy 向量化计算
+    每次 create_vdb 生成一个版本目录 {name}.v{版本号}/（vectors.f32 存向量，meta.json 存维度和 payload 列表），
+    写完后原子替换指针文件 {name}.current，读端只按指针加载，向量和 payload 总是同一个版本
+    '''
+    def __init__(self, name, path=LOCAL_VDB_PATH):
+        self.name = name
+        self.path = path
+        self.pointer_file = os.path.join(path, f"{name}.current")
+        self._matrix = None
+        self._payloads = []
+        self._version = None
+        self._checked_at = 0
+        self.metrics = get_metrics("local_vdb")
+
+    def _version_dir(self, version):
+        return os.path.join(self.path, f"{self.name}.v{version}")
+
+    @classmethod
+    def build(cls, name, vectors, payloads, path=LOCAL_VDB_PATH):
+        os.makedirs(path, exist_ok=True)
+        index = cls(name, path)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        dimension = matrix.shape[1] if matrix.ndim == 2 else 0
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            matrix = matrix / norms
+        previous = index._read_pointer()
+        version = str(time.time_ns())
+        version_dir = index._version_dir(version)
+        os.makedirs(version_dir)
+        with open(os.path.join(version_dir, "vectors.f32"), "wb") as f:
+            f.write(matrix.astype(np.float32).tobytes())
+        with open(os.path.join(version_dir, "meta.json"), "w") as f:
+            json.dump({"dimension": dimension, "payloads": list(payloads)}, f, ensure_ascii=False)
+        # 先写临时指针再替换，在线进程要么看到旧版本要么看到完整的新版本
+        with open(index.pointer_file + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(index.pointer_file + ".tmp", index.pointer_file)
+        index._remove_old_versions(keep={version, previous})
+        return index
+
+    def _remove_old_versions(self, keep):
+        # 保留上一个版本，正在切换的读端还可能在读它
+        prefix = f"{self.name}.v"
+        for entry in os.listdir(self.path):
+            if entry.startswith(prefix) and entry[len(prefix):] not in keep:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def _read_pointer(self):
+        try:
+            with open(self.pointer_file) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def exists(self):
+        return self._read_pointer() is not None
+
+    def _load(self, version):
+        version_dir = self._version_dir(version)
+        with open(os.path.join(version_dir, "meta.json")) as f:
+            meta = json.load(f)
+        payloads = meta["payloads"]
+        dimension = meta["dimension"]
+        if payloads and dimension:
+            matrix = np.memmap(os.path.join(version_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(len(payloads), dimension))
+        else:
+            matrix = np.zeros((0, dimension or 1), dtype=np.float32)
+        self._matrix, self._payloads, self._version = matrix, payloads, version
+        logger.info(f'LocalVectorIndex {self.name} loaded {len(payloads)} vectors, version {version}')
+
+    def _ensure_loaded(self):
+        now = time.time()
+        if self._matrix is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            version = self._read_pointer()
+            if version is not None and version != self._version:
+                self._load(version)
+        except (OSError, ValueError) as e:
+            # 重建过程中读不到就继续用已加载的版本，下次检查再试
+            self.metrics.incr("reload_error")
+            logger.error(f'LocalVectorIndex {self.name} reload error {e}')
+        if self._matrix is None:
+            raise FileNotFoundError(f'LocalVectorIndex {self.name} not loaded')
+
+    def search_batch(self, vectors, topk=3):
+        self._ensure_loaded()
+        self.metrics.incr("search", len(vectors))
+        if not len(self._payloads):
+            return [[] for _ in vectors]
+        queries = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        scores = (queries / norms) @ self._matrix.T
+        k = min(topk, scores.shape[1])
+        out = []
+        for row in scores:
+            idx = np.argpartition(-row, k - 1)[:k]
+            idx = idx[np.argsort(-row[idx])]
+            out.append([{'payload': self._payloads[i], 'similarity': float(row[i])} for i in idx])
+        return out
+
+    def search(self, vector, topk=3):
+        return self.search_batch([vector], topk)[0]
+
+
+_indexes = {}
+_missing_logged = set()
+
+
+def get_local_index(name):
+    '''索引文件不存在时返回 None，由调用方回退到 qdrant'''
+    index = _indexes.get(name)
+    if index is None:
+        index = LocalVectorIndex(name)
+        if not index.exists():
+            if name not in _missing_logged:
+                _missing_logged.add(name)
+                logger.error(f'LocalVectorIndex {name} not found at {index.pointer_file}, fallback to qdrant')
+            return None
+        _indexes[name] = index
+    return index
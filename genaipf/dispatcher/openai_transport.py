@@ -0,0 +1,50 @@
+import aiohttp
+import openai
+from genaipf.conf.llm_conf import (
+    OPENAI_POOL_SIZE,
+    OPENAI_KEEPALIVE_TIMEOUT,
+    OPENAI_DNS_CACHE_TTL,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_REQUEST_TIMEOUT,
+)
+from genaipf.utils.http_utils import create_pooled_session, pool_stats
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+# 传给 openai 的 request_timeout：(连接超时, 总超时)
+request_timeout = (OPENAI_CONNECT_TIMEOUT, OPENAI_REQUEST_TIMEOUT)
+
+metrics = get_metrics("openai_transport")
+_session = None
+
+
+async def setup_openai_transport(app, loop):
+    '''before_server_start：每个 worker 创建一个共享的连接池 session'''
+    global _session
+    _session = create_pooled_session(
+        metrics,
+        limit=OPENAI_POOL_SIZE,
+        keepalive_timeout=OPENAI_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=OPENAI_DNS_CACHE_TTL,
+        timeout=aiohttp.ClientTimeout(connect=OPENAI_CONNECT_TIMEOUT, total=OPENAI_REQUEST_TIMEOUT),
+    )
+    logger.info(f'openai transport pool created, limit={OPENAI_POOL_SIZE}')
+
+
+async def close_openai_transport(app, loop):
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def bind_openai_session():
+    '''
+    openai==0.27.4 没有设置 aiosession 时每次请求都新建 ClientSession（重新握手），
+    aiosession 是 ContextVar，所以在每个调用 openai 的 task 里绑定一次
+    '''
+    if _session is None:
+        return
+    openai.aiosession.set(_session)
+    for k, v in pool_stats(_session).items():
+        metrics.set(f"pool_{k}", v)
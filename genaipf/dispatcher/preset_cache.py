@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+# 进程内最多缓存的 preset 结果条数
+PRESET_CACHE_MAX_ENTRIES = 2048
+# 后台刷新的检查间隔（秒），以及在 ttl 的多大比例时提前刷新
+REFRESH_INTERVAL = 1
+REFRESH_AHEAD = 0.8
+
+metrics = get_metrics("preset_cache")
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "last_access", "name", "conf", "args")
+
+    def __init__(self, value, name, conf, args):
+        self.value = value
+        self.fetched_at = time.time()
+        self.last_access = self.fetched_at
+        self.name = name
+        self.conf = conf
+        self.args = args
+
+
+class PresetCache:
+    '''
+    get_and_pick 的结果缓存，在 preset entry 里声明：
+    "cache": {"ttl": 秒, "stale_ttl": 过期后还能先返回旧值的秒数, "key_params": [...], "refresh": 是否后台保持热点 key}
+    key_params 默认是全部 param_names；相同 key 的并发请求只会调用一次 get_and_pick
+    '''
+    def __init__(self, max_entries=PRESET_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._refresher = None
+
+    @staticmethod
+    def _key(name, conf, args):
+        params = dict(zip(conf["param_names"], args))
+        key_params = conf["cache"].get("key_params") or conf["param_names"]
+        return name + ":" + json.dumps([params.get(x) for x in key_params], sort_keys=True, ensure_ascii=False, default=str)
+
+    def _fetch(self, key, name, conf, args):
+        '''single-flight：同一个 key 同时只有一个 get_and_pick 在执行'''
+        task = self._inflight.get(key)
+        if task is not None:
+            return task
+        task = asyncio.ensure_future(self._do_fetch(key, name, conf, args))
+        self._inflight[key] = task
+        return task
+
+    async def _do_fetch(self, key, name, conf, args):
+        t = time.time()
+        try:
+            value = await conf["get_and_pick"](*args)
+            self._entries[key] = _Entry(value, name, conf, args)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            metrics.observe(f"{name}_fetch_ms", (time.time() - t) * 1000)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def _refresh(self, key, entry, reason):
+        metrics.incr(f"{entry.name}_{reason}")
+        task = self._fetch(key, entry.name, entry.conf, entry.args)
+        task.add_done_callback(lambda t: self._on_refresh_done(entry.name, t))
+
+    @staticmethod
+    def _on_refresh_done(name, task):
+        if not task.cancelled() and task.exception() is not None:
+            metrics.incr(f"{name}_refresh_error")
+            logger.error(f'preset cache refresh {name} error {task.exception()}')
+
+    async def get_and_pick(self, name, conf, args):
+        cache_conf = conf.get("cache")
+        if not cache_conf:
+            return await conf["get_and_pick"](*args)
+        ttl = cache_conf.get("ttl", 60)
+        stale_ttl = cache_conf.get("stale_ttl", 0)
+        key = self._key(name, conf, args)
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            age = now - entry.fetched_at
+            if age < ttl + stale_ttl:
+                entry.last_access = now
+                self._entries.move_to_end(key)
+                if age < ttl:
+                    metrics.incr(f"{name}_hit")
+                else:
+                    # stale-while-revalidate：先返回旧值，后台刷新
+                    metrics.incr(f"{name}_stale")
+                    if key not in self._inflight:
+                        self._refresh(key, entry, "refresh")
+                if cache_conf.get("refresh"):
+                    self._ensure_refresher()
+                return entry.value
+        metrics.incr(f"{name}_coalesced" if key in self._inflight else f"{name}_miss")
+        if cache_conf.get("refresh"):
+            self._ensure_refresher()
+        # shield：一个请求被取消不影响其他等待同一次 fetch 的请求
+        return await asyncio.shield(self._fetch(key, name, conf, args))
+
+    def _ensure_refresher(self):
+        if self._refresher is None:
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        '''后台刷新：声明了 refresh 的 key 在上次取数之后被访问过（热点），快到 ttl 时提前刷新'''
+        try:
+            while True:
+                await asyncio.sleep(REFRESH_INTERVAL)
+                now = time.time()
+                watched = 0
+                for key, entry in list(self._entries.items()):
+                    cache_conf = entry.conf["cache"]
+                    if not cache_conf.get("refresh"):
+                        continue
+                    ttl = cache_conf.get("ttl", 60)
+                    if now - entry.fetched_at > ttl + cache_conf.get("stale_ttl", 0):
+                        continue
+                    watched += 1
+                    hot = entry.last_access > entry.fetched_at
+                    if hot and now - entry.fetched_at >= ttl * REFRESH_AHEAD and key not in self._inflight:
+                        self._refresh(key, entry, "background_refresh")
+                metrics.set("refresh_watched", watched)
+                if watched == 0:
+                    break
+        finally:
+            self._refresher = None
+
+
+preset_cache = PresetCache()
@@ -1,19 +1,72 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
 from importlib import import_module
 from genaipf.conf.server import PLUGIN_NAME
+from genaipf.conf.llm_conf import PROMPT_TIME_GRANULARITY
+from genaipf.utils.metrics_utils import get_metrics
 
 from genaipf.dispatcher.prompt_templates_v001.default import _get_default_afunc_prompt, _get_default_aref_answer_prompt, _get_default_merge_ref_and_input_text
 
+
+def prompt_now(granularity=PROMPT_TIME_GRANULARITY):
+    # 按配置的精度取整的当前时间
+    ts = int(datetime.now().timestamp())
+    return datetime.fromtimestamp(ts - ts % granularity)
+
+
+class PromptCache:
+    '''
+    渲染好的静态 prompt 前缀缓存，key 为 (prompt 类型, language, model, preset_name, 时间)
+    时间按 PROMPT_TIME_GRANULARITY 取整，同一时间段内的请求拿到字节级一致的前缀
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = get_metrics("prompt_cache")
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            text = self._data.get(key)
+            if text is not None:
+                self._data.move_to_end(key)
+        if text is not None:
+            self.metrics.incr("hit")
+            return text
+        self.metrics.incr("miss")
+        text = render()
+        with self._lock:
+            self._data[key] = text
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return text
+
+
+prompt_cache = PromptCache()
+
 _default_lang = "en"
 class LionPrompt:
+    '''
+    只有这里内置的默认 prompt 会走 PromptCache；设置了 PLUGIN_NAME 时用插件自己的 LionPrompt，
+    插件的 get_*_prompt 每次整体渲染，不会被缓存，除非插件在静态部分自己调用 static_prompt
+    '''
     default_lang = _default_lang
+
+    @classmethod
+    def static_prompt(cls, kind, language, model, preset_name, render):
+        '''render(now) 只渲染不含参考资料的静态部分，同一时间段内返回缓存的结果'''
+        now = prompt_now()
+        key = (cls.__name__, kind, language, model, preset_name, now)
+        return prompt_cache.get_or_render(key, lambda: render(now))
     
     @classmethod
-    def get_afunc_prompt(cls, language=_default_lang):
-        return _get_default_afunc_prompt(language)
+    def get_afunc_prompt(cls, language=_default_lang, picked_content="", related_qa=[], model=''):
+        return cls.static_prompt("afunc", language, model, None, lambda now: _get_default_afunc_prompt(language, model, now))
 
     @classmethod
-    def get_aref_answer_prompt(cls, language=_default_lang, preset_name=None, model=''):
-        return _get_default_aref_answer_prompt(language, model)
+    def get_aref_answer_prompt(cls, language=_default_lang, preset_name=None, picked_content="", related_qa=[], model=''):
+        return cls.static_prompt("aref_answer", language, model, preset_name, lambda now: _get_default_aref_answer_prompt(language, model, now))
 
     @classmethod
     def get_merge_ref_and_input_prompt(cls, ref, related_qa, input_text, language=_default_lang, preset_name=None, data={}):
@@ -23,4 +76,3 @@ if PLUGIN_NAME:
     plugin_submodule_name = f'{PLUGIN_NAME}.dispatcher.prompts_v001'
     plugin_submodule = import_module(plugin_submodule_name)
     LionPrompt = plugin_submodule.LionPrompt
-
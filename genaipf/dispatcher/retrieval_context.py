@@ -0,0 +1,63 @@
+import asyncio
+import typing
+from genaipf.dispatcher.utils import (
+    aget_embedding,
+    asearch_vdb_batch,
+    filter_by_similarity,
+    format_qa_results,
+    qa_coll_name,
+)
+from genaipf.utils.metrics_utils import get_metrics
+
+
+class RetrievalContext:
+    '''
+    单次对话请求内共享的检索结果：
+    每段不同的文本只算一次 embedding，每个 (collection, 文本, topk) 只查一次向量库，
+    QA 检索、函数筛选、prompt 拼接都从这里取
+    '''
+    def __init__(self):
+        self._embeddings = {}
+        self._searches = {}
+        self.metrics = get_metrics("retrieval_context")
+
+    def _shared(self, cache, key, factory, metric_name):
+        task = cache.get(key)
+        if task is None:
+            self.metrics.incr(f"{metric_name}_miss")
+            task = asyncio.ensure_future(factory())
+            cache[key] = task
+        else:
+            self.metrics.incr(f"{metric_name}_hit")
+        # 某个调用方被取消时不影响其他共享同一结果的调用方
+        return asyncio.shield(task)
+
+    async def embedding(self, text: str):
+        return await self._shared(self._embeddings, text, lambda: aget_embedding(text), "embedding")
+
+    async def _search_batch(self, texts, cname: str, topk: int):
+        vectors = await asyncio.gather(*[self.embedding(text) for text in texts])
+        return await asearch_vdb_batch(cname, vectors, topk)
+
+    async def vdb_topk_batch(self, texts, cname: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.List[typing.Mapping]]:
+        # 还没查过的文本合并成一次 search_batch，已查过（或正在查）的直接复用
+        missing = [text for text in dict.fromkeys(texts) if (cname, text, topk) not in self._searches]
+        self.metrics.incr("search_hit", len(texts) - len(missing))
+        if missing:
+            self.metrics.incr("search_miss", len(missing))
+            batch_task = asyncio.ensure_future(self._search_batch(missing, cname, topk))
+            for i, text in enumerate(missing):
+                self._searches[(cname, text, topk)] = asyncio.ensure_future(_pick(batch_task, i))
+        results = await asyncio.gather(*[asyncio.shield(self._searches[(cname, text, topk)]) for text in texts])
+        return [filter_by_similarity(x, sim_th) for x in results]
+
+    async def vdb_topk(self, text: str, cname: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
+        return (await self.vdb_topk_batch([text], cname, sim_th, topk))[0]
+
+    async def qa_topk(self, text: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[str]:
+        results = await self.vdb_topk(text, qa_coll_name, sim_th, topk)
+        return format_qa_results(results)
+
+
+async def _pick(batch_task, i):
+    return (await asyncio.shield(batch_task))[i]
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from collections import deque
+from genaipf.conf.llm_conf import (
+    LLM_RATE_LIMITS,
+    LLM_MAX_QUEUE,
+    LLM_MAX_QUEUE_WAIT,
+    LLM_LANE_WEIGHTS,
+    LLM_PAID_RESERVED_SHARE,
+    LLM_RATE_LIMIT_BACKOFF,
+    LLM_RATE_LIMIT_MAX_BACKOFF,
+)
+from genaipf.conf.server import WORKERS
+from genaipf.constant.error_code import ERROR_CODE
+from genaipf.exception.customer_exception import CustomerError
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+LANE_PAID = "paid"
+LANE_FREE = "free"
+LANES = (LANE_PAID, LANE_FREE)
+
+metrics = get_metrics("llm_scheduler")
+
+
+def lane_for_model(model):
+    # ml-plus 是付费次数，其余走免费通道
+    return LANE_PAID if model == 'ml-plus' else LANE_FREE
+
+
+class TokenBucket:
+    '''按分钟配额匀速补充的令牌桶，容量等于每分钟配额'''
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, reserved_share=0):
+        # reserved_share 部分的容量留给更高优先级，不能被占用
+        reserved = self.capacity * reserved_share
+        # 单个请求超过可用容量时按可用容量算，否则永远拿不到
+        need = min(amount, self.capacity - reserved) + reserved
+        if self.tokens >= need:
+            return 0
+        return (need - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0)
+
+
+class ModelScheduler:
+    '''
+    单个模型的准入控制：RPM 和 TPM 两个令牌桶，由一个 pump task 在配额足够时放行
+    请求按通道排队，通道内先到先得；多个通道同时可放行时按权重轮转（smooth weighted round robin），
+    paid 通道有请求在排队时，free 通道只能使用预留给 paid 之外的那部分配额；
+    没有 paid 请求的模型（例如只给免费用户用的模型）不预留，free 可以用满
+    '''
+    def __init__(self, model, rpm, tpm, max_queue=LLM_MAX_QUEUE, max_wait=LLM_MAX_QUEUE_WAIT,
+                 weights=LLM_LANE_WEIGHTS, paid_reserved_share=LLM_PAID_RESERVED_SHARE):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = {lane: weights.get(lane, 1) for lane in LANES}
+        self.paid_reserved_share = paid_reserved_share
+        self._lanes = {lane: deque() for lane in LANES}
+        self._credit = {lane: 0 for lane in LANES}
+        self._pump_task = None
+        # 有新请求入队或退回 token 时唤醒 pump，重新计算预留和等待时间
+        self._wakeup = asyncio.Event()
+        # 429 之后暂停放行到这个时间点（monotonic），连续 429 时退避时间翻倍
+        self.paused_until = 0
+        self._backoff = 0
+
+    def _set_depth(self, lane):
+        metrics.set(f"{self.model}_{lane}_queue_depth", len(self._lanes[lane]))
+
+    def _busy(self, lane, reason):
+        metrics.incr(f"{self.model}_{lane}_shed_{reason}")
+        logger.info(f'llm scheduler {self.model}/{lane} shed request: {reason}, queue={len(self._lanes[lane])}')
+        return CustomerError(status_code=ERROR_CODE['SERVER_BUSY'])
+
+    async def acquire(self, est_tokens, lane=LANE_FREE):
+        '''在 lane 通道排队直到 RPM/TPM 配额足够；队列已满或等待超时抛出 SERVER_BUSY'''
+        waiters = self._lanes[lane]
+        if len(waiters) >= self.max_queue:
+            raise self._busy(lane, "queue_full")
+        fut = asyncio.get_running_loop().create_future()
+        t = time.monotonic()
+        waiters.append((fut, est_tokens))
+        self._set_depth(lane)
+        self._wakeup.set()
+        if self._pump_task is None:
+            self._pump_task = asyncio.ensure_future(self._pump())
+        try:
+            # 超时会取消 fut，pump 会跳过已取消的等待者
+            await asyncio.wait_for(fut, self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._busy(lane, "timeout")
+        wait_ms = (time.monotonic() - t) * 1000
+        metrics.incr(f"{self.model}_{lane}_granted")
+        metrics.incr(f"{self.model}_{lane}_granted_tokens", est_tokens)
+        metrics.observe(f"{self.model}_{lane}_wait_ms", wait_ms)
+
+    def report_rate_limited(self, retry_after=None):
+        '''
+        上游仍然返回 429 时暂停放行：有 Retry-After 按它来，否则指数退避；
+        同时清空两个令牌桶，恢复后从零开始匀速放行
+        '''
+        metrics.incr(f"{self.model}_upstream_429")
+        self._backoff = min(self._backoff * 2 or LLM_RATE_LIMIT_BACKOFF, LLM_RATE_LIMIT_MAX_BACKOFF)
+        pause = retry_after if retry_after is not None else self._backoff
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        metrics.observe(f"{self.model}_backoff_ms", pause * 1000)
+        self.requests.drain()
+        self.tokens.drain()
+
+    def refund(self, amount):
+        '''请求结束后退回预扣但没用到的 token'''
+        if amount <= 0:
+            return
+        self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + amount)
+        metrics.incr(f"{self.model}_refunded_tokens", amount)
+        self._wakeup.set()
+
+    def report_ok(self):
+        '''上游请求成功，退避时间重置'''
+        self._backoff = 0
+
+    def _head(self, lane):
+        waiters = self._lanes[lane]
+        while waiters and waiters[0][0].done():
+            waiters.popleft()
+        return waiters[0] if waiters else None
+
+    def _pick(self, ready):
+        # smooth weighted round robin：只在可放行的通道之间分配
+        total = 0
+        for lane in ready:
+            self._credit[lane] += self.weights[lane]
+            total += self.weights[lane]
+        lane = max(ready, key=lambda x: self._credit[x])
+        self._credit[lane] -= total
+        return lane
+
+    async def _sleep(self, timeout):
+        # 最多等 timeout 秒，期间有新请求或退回的 token 就提前醒来
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _pump(self):
+        try:
+            while True:
+                # 先清掉再看队列，之后入队的请求一定能唤醒下一次等待
+                self._wakeup.clear()
+                heads = {lane: self._head(lane) for lane in LANES}
+                heads = {lane: head for lane, head in heads.items() if head is not None}
+                if not heads:
+                    break
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                # 只在 paid 有请求等待时才给它预留配额
+                reserved = {LANE_PAID: 0, LANE_FREE: self.paid_reserved_share if LANE_PAID in heads else 0}
+                waits = {
+                    lane: max(self.requests.wait_time(1, reserved[lane]),
+                              self.tokens.wait_time(est_tokens, reserved[lane]))
+                    for lane, (_, est_tokens) in heads.items()
+                }
+                ready = [lane for lane in LANES if waits.get(lane) == 0]
+                if not ready:
+                    await self._sleep(min(waits.values()))
+                    continue
+                lane = self._pick(ready)
+                fut, est_tokens = self._lanes[lane].popleft()
+                self.requests.take(1)
+                self.tokens.take(est_tokens)
+                fut.set_result(None)
+                self._set_depth(lane)
+        finally:
+            self._pump_task = None
+            for lane in LANES:
+                self._set_depth(lane)
+
+
+_schedulers = {}
+
+
+def get_scheduler(model):
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        rpm, tpm = LLM_RATE_LIMITS.get(model, LLM_RATE_LIMITS.get("default", [3500, 90000]))
+        # 令牌桶在每个 worker 进程里各有一份，配额按 worker 数平分
+        scheduler = ModelScheduler(model, rpm / WORKERS, tpm / WORKERS)
+        _schedulers[model] = scheduler
+    return scheduler
+
+
+async def acquire_llm_slot(model, prompt_tokens, max_tokens, lane=LANE_FREE):
+    '''
+    在调用 ChatCompletion 之前获取配额，token 先按 prompt + max_tokens 预扣（保证不超上游 TPM），
+    调用方在流结束后用 refund 退回没生成的部分，否则实际能用的配额会远小于 TPM
+    '''
+    await get_scheduler(model).acquire(prompt_tokens + max_tokens, lane)
@@ -0,0 +1,159 @@
+import asyncio
+import copy
+import hashlib
+import json
+from genaipf.conf.llm_conf import LLM_STREAM_DEDUP_ENABLED
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+
+metrics = get_metrics("stream_dedup")
+
+
+def payload_key(payload):
+    '''请求参数的规范化哈希，作为去重 key'''
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class UpstreamCancelled(Exception):
+    '''上游流因为订阅者全部离开被取消，还没离开的订阅者收到这个普通异常，而不是 CancelledError'''
+
+
+def _fresh(error):
+    '''每个订阅者拿到异常的副本，避免多个协程同时抛同一个异常对象（traceback/__context__ 会互相覆盖）'''
+    try:
+        fresh = copy.copy(error)
+    except Exception:
+        return error
+    fresh.__traceback__ = None
+    fresh.__context__ = None
+    fresh.__cause__ = None
+    return fresh
+
+
+def _forget(broadcast):
+    if _inflight.get(broadcast.key) is broadcast:
+        del _inflight[broadcast.key]
+    metrics.set("inflight", len(_inflight))
+
+
+class _Broadcast:
+    '''
+    一个上游流，可以有多个订阅者：由独立的 pump task 读取上游并缓存所有 chunk，
+    订阅者先回放已缓存的 chunk 再跟随实时输出；订阅者全部离开时取消上游
+    '''
+    def __init__(self, key, opener):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.opened = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._pump(opener))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, opener):
+        stream = None
+        try:
+            stream = await opener()
+            self.opened.set_result(None)
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = UpstreamCancelled()
+            metrics.incr("upstream_cancelled")
+        except Exception as e:
+            self.error = e
+        finally:
+            if not self.opened.done():
+                self.opened.set_exception(self.error)
+                # 没人等的时候避免 "exception was never retrieved"
+                self.opened.exception()
+            self.done = True
+            self._notify()
+            _forget(self)
+            if stream is not None and hasattr(stream, "aclose"):
+                try:
+                    await stream.aclose()
+                except Exception as e:
+                    logger.error(f'stream dedup close upstream error {e}')
+
+    def release(self):
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.done:
+            # 没有订阅者了，不再继续消耗上游 token；先移出 _inflight，
+            # 避免取消生效前到达的相同请求加入这个正在结束的流
+            _forget(self)
+            self._task.cancel()
+
+
+class _Subscription:
+    '''单个订阅者看到的流，接口和 openai 的流式响应一致（async for / aclose）'''
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.index = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        b = self.broadcast
+        while not self.closed:
+            if self.index < len(b.chunks):
+                chunk = b.chunks[self.index]
+                self.index += 1
+                return chunk
+            if b.done:
+                error = b.error
+                await self.aclose()
+                if error is not None:
+                    raise _fresh(error)
+                break
+            await b._changed.wait()
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcast.release()
+
+
+_inflight = {}
+
+
+async def dedup_stream(payload, opener):
+    '''
+    payload 相同的请求共享一个上游流：第一个请求调用 opener() 打开上游（含排队限流），
+    之后相同的请求直接订阅，先回放已生成的部分再跟随实时输出
+    打开上游失败时每个等待的请求都会收到这个异常的一个副本
+    '''
+    if not LLM_STREAM_DEDUP_ENABLED:
+        return await opener()
+    key = payload_key(payload)
+    broadcast = _inflight.get(key)
+    if broadcast is None:
+        broadcast = _Broadcast(key, opener)
+        _inflight[key] = broadcast
+        metrics.incr("owners")
+        metrics.set("inflight", len(_inflight))
+    else:
+        metrics.incr("hits")
+        metrics.incr("replayed_chunks", len(broadcast.chunks))
+        logger.info(f'stream dedup hit {key[:12]}, subscribers={broadcast.subscribers + 1}')
+    broadcast.subscribers += 1
+    try:
+        # shield：一个订阅者被取消不影响其他订阅者等待上游打开
+        await asyncio.shield(broadcast.opened)
+    except Exception as e:
+        broadcast.release()
+        raise _fresh(e) from None
+    except BaseException:
+        broadcast.release()
+        raise
+    return _Subscription(broadcast)
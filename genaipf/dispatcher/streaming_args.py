@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+from genaipf.utils.metrics_utils import get_metrics
+
+metrics = get_metrics("preset_prefetch")
+
+
+class StreamingArgumentsParser:
+    '''
+    增量解析流式返回的 function_call.arguments（顶层是一个 JSON 对象）：
+    每次 feed 一段增量，顶层字段的值一结束（遇到同层的 , 或 }）就解析出来放进 values
+    '''
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.values = {}
+        self.closed = False
+        self.error = False
+
+    def _end_value(self, end):
+        if self.key is not None and self.value_start is not None:
+            raw = self.text[self.value_start:end].strip()
+            try:
+                self.values[self.key] = json.loads(raw)
+            except ValueError:
+                self.error = True
+        self.key = None
+        self.value_start = None
+
+    def feed(self, chunk):
+        if not chunk or self.closed or self.error:
+            return
+        self.text += chunk
+        text = self.text
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        try:
+                            self.key = json.loads(text[self.key_start:i + 1])
+                        except ValueError:
+                            self.error = True
+                        self.key_start = None
+                continue
+            if c == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.key_start = i
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                if self.depth == 1:
+                    self._end_value(i)
+                    self.closed = True
+                self.depth -= 1
+            elif self.depth == 1 and c == ":" and self.key is not None and self.value_start is None:
+                self.value_start = i + 1
+            elif self.depth == 1 and c == ",":
+                self._end_value(i)
+        self.pos = len(text)
+
+    def has_all(self, keys):
+        return not self.error and all(k in self.values for k in keys)
+
+
+class PresetPrefetch:
+    '''
+    函数参数还在流式返回时，preset 需要的参数（函数定义里有的 param_names）一齐就提前调用 get_and_pick，
+    和参数流剩下的部分并行；参数流结束后最终参数一致就直接用提前取到的结果，不一致则取消重取
+    '''
+    def __init__(self, preset_conf, function_schema, injected, fetch=None):
+        properties = ((function_schema or {}).get("parameters") or {}).get("properties") or {}
+        self.preset_conf = preset_conf
+        # language、subtype 这类参数不是模型给的，由调用方注入
+        self.injected = injected
+        # fetch(args) 默认直接调用 get_and_pick，可以换成带缓存的版本
+        self.fetch = fetch or (lambda args: preset_conf["get_and_pick"](*args))
+        self.keys = [x for x in preset_conf["param_names"] if x in properties and x not in injected]
+        self.parser = StreamingArgumentsParser()
+        self.task = None
+        self.args = None
+        self.started_at = None
+
+    def args_from(self, param):
+        param = {**param, **self.injected}
+        return [param.get(x) for x in self.preset_conf["param_names"]]
+
+    def feed(self, delta):
+        if self.task is not None or not self.keys:
+            return
+        self.parser.feed(delta)
+        if self.parser.has_all(self.keys):
+            self.args = self.args_from(self.parser.values)
+            self.task = asyncio.ensure_future(self.fetch(self.args))
+            self.started_at = time.time()
+            metrics.incr("started")
+
+    async def result(self, final_args):
+        if self.task is not None:
+            if self.args == final_args:
+                metrics.incr("hit")
+                # 参数流结束时提前请求已经跑了多久，即省下的时间上限
+                metrics.observe("overlap_ms", (time.time() - self.started_at) * 1000)
+                return await self.task
+            metrics.incr("mismatch")
+            self.cancel()
+        return await self.fetch(final_args)
+
+    def cancel(self):
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled():
+            # 取走异常，避免 "Task exception was never retrieved"
+            self.task.exception()
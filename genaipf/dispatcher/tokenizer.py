@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import regex
+import tiktoken
+from genaipf.utils.metrics_utils import get_metrics
+
+# token 数缓存的条数上限
+TOKEN_COUNT_CACHE_SIZE = 4096
+# 超过这个字符数的字符串放到线程池里编码，避免阻塞事件循环
+OFFLOAD_MIN_CHARS = 20000
+
+metrics = get_metrics("tokenizer")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except:
+        return tiktoken.encoding_for_model('gpt2')  # Fallback for others.
+
+
+class _TokenCountCache:
+    def __init__(self, max_size=TOKEN_COUNT_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            n = self._data.get(key)
+            if n is not None:
+                self._data.move_to_end(key)
+            return n
+
+    def put(self, key, n):
+        with self._lock:
+            self._data[key] = n
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+_count_cache = _TokenCountCache()
+
+
+def count_tokens(text, model):
+    '''带缓存的 token 计数，QA 答案、preset 内容这类重复出现的字符串只编码一次'''
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    key = (encoding.name, hashlib.sha1(text.encode("utf-8")).digest())
+    n = _count_cache.get(key)
+    if n is not None:
+        metrics.incr("count_hit")
+        return n
+    metrics.incr("count_miss")
+    n = len(encoding.encode(text))
+    _count_cache.put(key, n)
+    return n
+
+
+@lru_cache(maxsize=None)
+def _pre_token_pattern(encoding):
+    # tiktoken 先按这个正则切成预分词片段，再在每个片段内做 BPE
+    pat_str = getattr(encoding, "_pat_str", None)
+    return regex.compile(pat_str) if pat_str else None
+
+
+def _stable_prefix(encoding, prefix):
+    '''
+    去掉前缀末尾可能被切开的预分词片段：切口前完整的片段和完整文本里的切分、编码都相同，
+    连续无空格的中日韩文字会整段是一个片段，这时返回空串，由调用方加长前缀
+    '''
+    pattern = _pre_token_pattern(encoding)
+    if pattern is None:
+        return ""
+    # 最后一个片段可能被切开，倒数第二个片段的切分可能受下一个字符影响（如空白后的前瞻）
+    pieces = pattern.findall(prefix)
+    return "".join(pieces[:-2])
+
+
+def truncate_tokens(text, model, limit):
+    '''
+    截断到 limit 个 token，只编码需要的前缀：
+    每个 token 至少 1 个字节，字节数不超过 limit 时直接返回；
+    否则从 limit*4 个字符的前缀开始，只编码其中完整的预分词片段，token 不够再加倍，
+    结果和完整编码后取前 limit 个 token 一致
+    '''
+    if len(text.encode("utf-8")) <= limit:
+        metrics.incr("truncate_skip")
+        return text
+    encoding = get_encoding(model)
+    n_chars = max(limit * 4, 64)
+    while True:
+        if n_chars >= len(text):
+            metrics.incr("truncate_full")
+            tokens = encoding.encode(text)
+            return text if len(tokens) <= limit else encoding.decode(tokens[:limit])
+        tokens = encoding.encode(_stable_prefix(encoding, text[:n_chars]))
+        if len(tokens) >= limit:
+            metrics.incr("truncate_prefix")
+            return encoding.decode(tokens[:limit])
+        n_chars *= 2
+
+
+async def run_offloaded(size_hint, func, *args):
+    '''size_hint（字符数）较大时在线程池里执行 func，tiktoken 编码时会释放 GIL'''
+    if size_hint < OFFLOAD_MIN_CHARS:
+        return func(*args)
+    metrics.incr("offloaded")
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def acount_tokens(text, model):
+    return await run_offloaded(len(text or ""), count_tokens, text, model)
+
+
+async def atruncate_tokens(text, model, limit):
+    return await run_offloaded(len(text), truncate_tokens, text, model, limit)
@@ -3,11 +3,9 @@ import typing
 import openai
 import tqdm
 import pandas as pd
-from functools import cache
 from qdrant_client import QdrantClient
-from qdrant_client.http import models
+from qdrant_client.http import models, AsyncApis
 from dotenv import load_dotenv
-import tiktoken
 
 load_dotenv(override=True)
 
@@ -16,23 +14,72 @@ MAX_CH_LENGTH_GPT3 = 8000
 MAX_CH_LENGTH_GPT4 = 3000
 MAX_CH_LENGTH_QA_GPT3 = 3000
 MAX_CH_LENGTH_QA_GPT4 = 1500
-qdrant_url = "http://localhost:6333"
 
 from genaipf.conf.server import PLUGIN_NAME
+from genaipf.conf.embedding_conf import EMBEDDING_STORE_ONLINE
+from genaipf.conf.vdb_conf import QDRANT_URL, VDB_BACKEND, LOCAL_VDB_COLLECTIONS
+from genaipf.dispatcher.embedding_batcher import get_embedding_batcher
+from genaipf.dispatcher.embedding_providers import get_embedding_provider, OpenAIEmbeddingProvider
+from genaipf.dispatcher.embedding_cache import embedding_cache
+from genaipf.dispatcher.embedding_store import EmbeddingStore
+from genaipf.dispatcher.local_vdb import get_local_index
+from genaipf.dispatcher.tokenizer import truncate_tokens
+qdrant_url = QDRANT_URL
+embedding_provider = get_embedding_provider()
+_model_providers = {}
+dimension = embedding_provider.dimension
 vdb_prefix = PLUGIN_NAME
 
 qa_coll_name = f"{vdb_prefix}_filtered_qa"
 gpt_func_coll_name = f"{vdb_prefix}_gpt_func"
+answer_cache_coll_name = f"{vdb_prefix}_answer_cache"
+# 可以用进程内索引的小集合，create_vdb 时会同时生成本地索引文件
+local_vdb_coll_names = [f"{vdb_prefix}_{x}" for x in LOCAL_VDB_COLLECTIONS]
 
 client = QdrantClient(qdrant_url)
+# 在线检索用的异步 qdrant REST 客户端，不阻塞事件循环
+aclient = AsyncApis(host=qdrant_url)
+
+if EMBEDDING_STORE_ONLINE:
+    embedding_cache.attach_store(EmbeddingStore(dimension=dimension, readonly=True))
+
+def _get_provider(model=None):
+    # model 为空时用配置的 provider，指定了其他模型名时按 openai 模型处理
+    if model is None or model == embedding_provider.model:
+        return embedding_provider
+    provider = _model_providers.get(model)
+    if provider is None:
+        provider = OpenAIEmbeddingProvider(model)
+        _model_providers[model] = provider
+    return provider
+
+def get_embedding(text, model = None):
+    provider = _get_provider(model)
+    embedding = embedding_cache.get(text, provider.model)
+    if embedding is None:
+        embedding = provider.embed([text])[0]
+        embedding_cache.put(text, provider.model, embedding)
+    return embedding
 
-@cache
-def get_embedding(text, model = "text-embedding-ada-002"):
-    result = openai.Embedding.create(
-        model=model,
-        input=text
-    )
-    embedding = result["data"][0]["embedding"]
+def get_embeddings(texts, model = None):
+    # 批量版本，缓存未命中的文本合并成一次调用
+    provider = _get_provider(model)
+    embeddings = [embedding_cache.get(text, provider.model) for text in texts]
+    missing = list(dict.fromkeys(text for text, emb in zip(texts, embeddings) if emb is None))
+    if missing:
+        fetched = dict(zip(missing, provider.embed(missing)))
+        for text, emb in fetched.items():
+            embedding_cache.put(text, provider.model, emb)
+        embeddings = [emb if emb is not None else fetched[text] for text, emb in zip(texts, embeddings)]
+    return embeddings
+
+async def aget_embedding(text, model = None):
+    # 异步版本，缓存未命中时走跨请求合并的 EmbeddingBatcher
+    provider = _get_provider(model)
+    embedding = await embedding_cache.aget(text, provider.model)
+    if embedding is None:
+        embedding = await get_embedding_batcher(provider).embed(text)
+        await embedding_cache.aput(text, provider.model, embedding)
     return embedding
 
 
@@ -62,24 +109,57 @@ AI:
 """
 
 
+def search_vdb(cname: str, vector, topk: int = 3) -> typing.List[typing.Mapping]:
+    if VDB_BACKEND == "local" and cname in local_vdb_coll_names:
+        index = get_local_index(cname)
+        if index is not None:
+            return index.search(vector, topk)
+    search_results = client.search(cname, vector, limit=topk)
+    return [{'payload': result.payload, 'similarity': result.score} for result in search_results]
+
+async def asearch_vdb_batch(cname: str, vectors, topk: int = 3) -> typing.List[typing.List[typing.Mapping]]:
+    # 多个向量一次 search_batch 请求查完
+    if VDB_BACKEND == "local" and cname in local_vdb_coll_names:
+        index = get_local_index(cname)
+        if index is not None:
+            return index.search_batch(vectors, topk)
+    searches = [models.SearchRequest(vector=v, limit=topk, with_payload=True) for v in vectors]
+    resp = await aclient.points_api.search_batch_points(
+        collection_name=cname,
+        search_request_batch=models.SearchRequestBatch(searches=searches),
+    )
+    return [[{'payload': x.payload, 'similarity': x.score} for x in points] for points in resp.result]
+
+async def asearch_vdb(cname: str, vector, topk: int = 3) -> typing.List[typing.Mapping]:
+    return (await asearch_vdb_batch(cname, [vector], topk))[0]
+
+def filter_by_similarity(results, sim_th):
+    return [x for x in results if x['similarity'] >= sim_th]
+
 def get_vdb_topk(text: str, cname: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
     _vector = get_embedding(text)
-    search_results = client.search(cname, _vector, limit=topk)
-    wrapper_result = []
-    for result in search_results:
-        if result.score >= sim_th:
-            wrapper_result.append({'payload': result.payload, 'similarity': result.score})
-    return wrapper_result
+    return filter_by_similarity(search_vdb(cname, _vector, topk), sim_th)
 
-def get_qa_vdb_topk(text: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
-    # results = get_vdb_topk(text, "qa", sim_th, topk)
-    results = get_vdb_topk(text, qa_coll_name, sim_th, topk)
+async def aget_vdb_topk(text: str, cname: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
+    _vector = await aget_embedding(text)
+    return filter_by_similarity(await asearch_vdb(cname, _vector, topk), sim_th)
+
+def format_qa_results(results):
     out_l = []
     for x in results:
         v = f'{x["payload"].get("q")}: {x["payload"].get("a")}'
         out_l.append(v)
     return out_l
 
+def get_qa_vdb_topk(text: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
+    # results = get_vdb_topk(text, "qa", sim_th, topk)
+    results = get_vdb_topk(text, qa_coll_name, sim_th, topk)
+    return format_qa_results(results)
+
+async def aget_qa_vdb_topk(text: str, sim_th: float = 0.8, topk: int = 3) -> typing.List[typing.Mapping]:
+    results = await aget_vdb_topk(text, qa_coll_name, sim_th, topk)
+    return format_qa_results(results)
+
 def merge_ref_and_qa(picked_content, related_qa, language="en", model=''):
     _ref_text = "\n\n".join(str(picked_content))
     _ref_text = _ref_text.replace("\n", "")
@@ -101,11 +181,4 @@ def merge_ref_and_qa(picked_content, related_qa, language="en", model=''):
 def limit_tokens_from_string(string: str, model: str, limit: int) -> str:
     """Limits the string to a number of tokens (estimated)."""
 
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except:
-        encoding = tiktoken.encoding_for_model('gpt2')  # Fallback for others.
-
-    encoded = encoding.encode(string)
-
-    return encoding.decode(encoded[:limit])
\ No newline at end of file
+    return truncate_tokens(string, model, limit)
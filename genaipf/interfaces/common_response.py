@@ -1,5 +1,6 @@
 from sanic import response
 from genaipf.constant.error_code import ERROR_CODE, ERROR_MESSAGE
+from genaipf.utils.json_utils import response_dumps
 
 
 # 成功返回
@@ -10,7 +11,7 @@ def success(data, message="success", status="true", code=200):
         "message": message,
         "status": status
     }
-    return response.json(format_response)
+    return response.json(format_response, dumps=response_dumps)
 
 
 # 错误返回
@@ -20,4 +21,4 @@ def fail(code=500, message="fail", status="false"):
         "message": ERROR_MESSAGE[code],
         "status": status
     }
-    return response.json(format_response)
+    return response.json(format_response, dumps=response_dumps)
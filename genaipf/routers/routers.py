@@ -1,5 +1,5 @@
 from sanic import Blueprint
-from genaipf.controller import gpt, user, gptstrem, userRate, pay
+from genaipf.controller import gpt, user, gptstrem, userRate, pay, metrics
 from importlib import import_module
 from genaipf.conf.server import PLUGIN_NAME
 
@@ -18,6 +18,7 @@ blueprint_v1.add_route(gpt.get_message_list, "getMessageList", methods=["GET"])
 blueprint_v1.add_route(gpt.get_msggroup_list, "getMsgGroupList", methods=["GET"])
 blueprint_v1.add_route(gpt.del_msggroup_list, "delMsgGroupList", methods=["POST"])
 blueprint_v1.add_route(gptstrem.send_strem_chat, "sendStremChat", methods=["POST"])
+blueprint_v1.add_route(gptstrem.resume_strem_chat, "resumeStremChat", methods=["POST"])
 blueprint_v1.add_route(userRate.user_rate, 'userRate', methods=["POST"])
 blueprint_v1.add_route(userRate.del_message_by_codes, 'delMessages', methods=["POST"])
 blueprint_v1.add_route(userRate.share_message, 'shareMessages', methods=["POST"])
@@ -40,6 +41,9 @@ blueprint_v1.add_route(pay.check_order, "pay/orderCheck", methods=["GET"])
 blueprint_v1.add_route(pay.query_user_account, "pay/account", methods=["GET"])
 blueprint_v1.add_route(pay.pay_success_callback, "pay/callback", methods=["POST"])
 
+# 性能指标接口
+blueprint_v1.add_route(metrics.get_metrics, "metrics", methods=["GET"])
+
 if PLUGIN_NAME:
     plugin_submodule_name = f'{PLUGIN_NAME}.routers.entry'
     plugin_submodule = import_module(plugin_submodule_name)
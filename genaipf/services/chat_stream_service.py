@@ -0,0 +1,179 @@
+import asyncio
+import secrets
+import time
+from genaipf.conf.server import (
+    CHAT_STREAM_TTL,
+    CHAT_STREAM_MAX_FRAMES,
+    CHAT_STREAM_MAX_BYTES,
+    CHAT_STREAM_POLL_MS,
+)
+from genaipf.constant.redis_keys import REDIS_KEYS
+from genaipf.utils.log_utils import logger
+from genaipf.utils.metrics_utils import get_metrics
+from genaipf.utils.redis_utils import RedisConnectionPool
+
+metrics = get_metrics("chat_stream")
+
+STATUS_LIVE = "live"
+STATUS_DONE = "done"
+STATUS_TRUNCATED = "truncated"
+STATUS_OVERFLOW = "overflow"
+# 续传请求在读的时候每次轮询刷新 reader_at，生成端据此判断是否还有人在等
+READER_ALIVE_SECONDS = 3
+
+
+def _frames_key(code):
+    return REDIS_KEYS['CHAT_STREAM_KEYS']['FRAMES'].format(code)
+
+
+def _meta_key(code):
+    return REDIS_KEYS['CHAT_STREAM_KEYS']['META'].format(code)
+
+
+async def _run_redis(func, *args):
+    # redis 客户端是同步的，放到线程池里执行
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def new_resume_token():
+    return secrets.token_hex(8)
+
+
+class ChatStreamBuffer:
+    '''
+    生成端：把发给客户端的每一帧按顺序追加到 Redis Stream，id 是 0-{帧序号}（从 1 开始），
+    客户端收到第 n 帧后断开，续传时从第 n+1 帧开始回放
+    超过帧数或字节上限后不再缓存，状态记为 overflow，续传时只能回放上限以内的部分
+    '''
+    def __init__(self, code, resume_token):
+        self.code = code
+        self.resume_token = resume_token
+        self.seq = 0
+        self.bytes = 0
+        self.status = STATUS_LIVE
+        self.seen_done = False
+        self._pending = []
+        self._meta = {"token": resume_token, "status": STATUS_LIVE}
+        self._flush_task = None
+        self._reader_checked = (0, False)
+
+    def append(self, frames):
+        '''SSEFrameWriter 的 on_frames 回调，只在内存里排队，由后台 task 批量写入 Redis'''
+        for frame in frames:
+            if frame == "[DONE]":
+                self.seen_done = True
+            if self.status == STATUS_OVERFLOW:
+                continue
+            self.bytes += len(frame)
+            if self.seq >= CHAT_STREAM_MAX_FRAMES or self.bytes > CHAT_STREAM_MAX_BYTES:
+                self.status = STATUS_OVERFLOW
+                self._meta["status"] = STATUS_OVERFLOW
+                metrics.incr("buffer_overflow")
+                continue
+            self.seq += 1
+            self._pending.append((self.seq, frame))
+        self._schedule()
+
+    @property
+    def resumable(self):
+        return self.status != STATUS_OVERFLOW
+
+    def _schedule(self):
+        if self._flush_task is None and (self._pending or self._meta):
+            self._flush_task = asyncio.ensure_future(self._flusher())
+
+    async def _flusher(self):
+        try:
+            while self._pending or self._meta:
+                batch, self._pending = self._pending, []
+                meta, self._meta = self._meta, {}
+                await _run_redis(self._write_batch, batch, meta)
+        except Exception as e:
+            logger.error(f'chat stream buffer {self.code} write error {e}')
+        finally:
+            self._flush_task = None
+
+    def _write_batch(self, batch, meta):
+        frames_key = _frames_key(self.code)
+        meta_key = _meta_key(self.code)
+        pipe = RedisConnectionPool().get_connection().pipeline(transaction=False)
+        for seq, frame in batch:
+            pipe.xadd(frames_key, {"d": frame}, id=f"0-{seq}", maxlen=CHAT_STREAM_MAX_FRAMES, approximate=True)
+        if meta:
+            meta["frames"] = self.seq
+            pipe.hmset(meta_key, meta)
+        pipe.expire(frames_key, CHAT_STREAM_TTL)
+        pipe.expire(meta_key, CHAT_STREAM_TTL)
+        pipe.execute()
+        metrics.incr("buffered_frames", len(batch))
+
+    async def has_reader(self):
+        '''最近是否有续传请求在读，最多每秒查一次 Redis'''
+        checked_at, alive = self._reader_checked
+        now = time.time()
+        if now - checked_at < 1:
+            return alive
+        reader_at = await _run_redis(RedisConnectionPool().get_connection().hget, _meta_key(self.code), "reader_at")
+        alive = bool(reader_at) and now - float(reader_at) < READER_ALIVE_SECONDS
+        self._reader_checked = (now, alive)
+        return alive
+
+    async def finish(self):
+        '''写入结束状态并等待所有帧落到 Redis'''
+        if self.status == STATUS_LIVE:
+            self.status = STATUS_DONE if self.seen_done else STATUS_TRUNCATED
+        self._meta["status"] = self.status
+        self._schedule()
+        while self._flush_task is not None:
+            await asyncio.shield(self._flush_task)
+        metrics.incr(f"finished_{self.status}")
+
+
+async def get_stream_meta(code):
+    return await _run_redis(RedisConnectionPool().get_connection().hgetall, _meta_key(code))
+
+
+async def read_stream_frames(code, offset, count=500):
+    '''读取序号大于 offset 的帧，返回 [(序号, 帧)]'''
+    entries = await _run_redis(RedisConnectionPool().get_connection().xrange, _frames_key(code), f"0-{offset + 1}", "+", count)
+    return [(int(entry_id.split("-")[1]), fields["d"]) for entry_id, fields in entries]
+
+
+async def touch_reader(code):
+    await _run_redis(RedisConnectionPool().get_connection().hset, _meta_key(code), "reader_at", time.time())
+
+
+async def follow_stream(code, offset, idle_timeout):
+    '''
+    续传端：先回放 offset 之后已缓存的帧，再轮询跟随生成端，直到结束状态或长时间没有新帧
+    每次产出一批帧 [帧, ...]
+    '''
+    last_frame_at = time.time()
+    while True:
+        await touch_reader(code)
+        entries = await read_stream_frames(code, offset)
+        if entries:
+            offset = entries[-1][0]
+            last_frame_at = time.time()
+            yield [frame for _, frame in entries]
+            continue
+        meta = await get_stream_meta(code)
+        if not meta or meta.get("status") != STATUS_LIVE:
+            # 生成端最后一批帧和结束状态是同一个 pipeline 写入的，可能正好落在上面的 XRANGE 和 HGETALL 之间，
+            # 看到结束状态后再读一次，保证收到 [DONE] 等最后的帧
+            while True:
+                entries = await read_stream_frames(code, offset)
+                if not entries:
+                    return
+                offset = entries[-1][0]
+                yield [frame for _, frame in entries]
+        if time.time() - last_frame_at > idle_timeout:
+            logger.info(f'chat stream {code} resume idle timeout')
+            return
+        await asyncio.sleep(CHAT_STREAM_POLL_MS / 1000)
+
+
+def mark_question_seen(question_code):
+    '''同一个问题 code 在缓存有效期内再次请求，说明客户端重新生成了一次'''
+    key = REDIS_KEYS['CHAT_STREAM_KEYS']['QUESTION'].format(question_code)
+    return not RedisConnectionPool().get_connection().set(key, 1, ex=CHAT_STREAM_TTL, nx=True)
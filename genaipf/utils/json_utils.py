@@ -0,0 +1,64 @@
+import datetime
+import decimal
+import json
+from json.encoder import encode_basestring_ascii
+
+# 有 orjson 时用 orjson，没有时退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj):
+    # 数据库查出来的 Decimal / datetime
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTION = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTION)
+
+    def _dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTION).decode("utf-8")
+
+    def loads(s):
+        return orjson.loads(s)
+
+    def text_frame(text):
+        return '{"text":' + orjson.dumps(text).decode("utf-8") + '}'
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _dumps(obj):
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(s):
+        return json.loads(s)
+
+    def text_frame(text):
+        return '{"text":' + encode_basestring_ascii(text) + '}'
+
+
+def dumps(obj, ensure_ascii=False):
+    '''
+    ensure_ascii=True 时非 ASCII 字符转义成 \\uXXXX（存库用，和之前 json.dumps 的结果一致），
+    orjson 不支持这个选项，走标准库
+    '''
+    if ensure_ascii:
+        return json.dumps(obj, default=_default)
+    return _dumps(obj)
+
+
+def response_dumps(obj, **kwargs):
+    '''给 sanic response.json 的 dumps 参数用'''
+    return dumps_bytes(obj)
@@ -0,0 +1,90 @@
+import time
+import threading
+from collections import defaultdict
+
+
+# 进程内的简单指标统计（计数器 + 观测值）
+class Metrics:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.observations = {}
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+
+    def set(self, key, value):
+        self.gauges[key] = value
+
+    def observe(self, key, value):
+        with self._lock:
+            obs = self.observations.get(key)
+            if obs is None:
+                obs = {"count": 0, "sum": 0.0, "max": value}
+                self.observations[key] = obs
+            obs["count"] += 1
+            obs["sum"] += value
+            obs["max"] = max(obs["max"], value)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.counters)
+            data.update(self.gauges)
+            for key, obs in self.observations.items():
+                data[f"{key}_count"] = obs["count"]
+                data[f"{key}_avg"] = obs["sum"] / obs["count"] if obs["count"] else 0
+                data[f"{key}_max"] = obs["max"]
+        return data
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(name):
+    with _registry_lock:
+        metrics = _registry.get(name)
+        if metrics is None:
+            metrics = Metrics(name)
+            _registry[name] = metrics
+        return metrics
+
+
+def snapshot_all():
+    return {name: m.snapshot() for name, m in list(_registry.items())}
+
+
+# 记录一次请求内各阶段耗时（毫秒），同时汇总到 metrics
+class StageTimer:
+    def __init__(self, name):
+        self.metrics = get_metrics(name)
+        self.t0 = time.time()
+        self._last = self.t0
+        self.stages = {}
+
+    def _record(self, stage, cost):
+        self.stages[stage] = round(cost * 1000, 1)
+        self.metrics.observe(f"{stage}_ms", cost * 1000)
+
+    def mark(self, stage):
+        # 顺序执行的阶段：记录距离上一次 mark 的耗时
+        now = time.time()
+        self._record(stage, now - self._last)
+        self._last = now
+
+    async def timed(self, stage, aw):
+        # 并发执行的阶段：单独记录这个 awaitable 自己的耗时
+        t = time.time()
+        try:
+            return await aw
+        finally:
+            self._record(stage, time.time() - t)
+
+    def summary(self):
+        data = dict(self.stages)
+        data["total"] = round((time.time() - self.t0) * 1000, 1)
+        self.metrics.observe("total_ms", data["total"])
+        return data
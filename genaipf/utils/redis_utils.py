@@ -23,3 +23,26 @@ class RedisConnectionPool:
         else:
             self.redis_client = redis.Redis(connection_pool=self.pool)
             return self.redis_client
+
+
+# 存取二进制数据（例如打包的向量）用的连接池，不做 decode
+class RedisBinaryConnectionPool:
+    redis_client = None
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(RedisBinaryConnectionPool, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        self.pool = redis.ConnectionPool(host=redis_conf.HOST, port=redis_conf.PORT, db=redis_conf.DB,
+                                         password=redis_conf.PASSWORD, decode_responses=False)
+
+    def get_connection(self):
+        if self.redis_client is not None:
+            return self.redis_client
+        else:
+            self.redis_client = redis.Redis(connection_pool=self.pool)
+            return self.redis_client
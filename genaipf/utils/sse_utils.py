@@ -0,0 +1,160 @@
+import asyncio
+import time
+from genaipf.conf.server import SSE_COALESCE_MS, SSE_COALESCE_BYTES
+from genaipf.utils.json_utils import text_frame
+from genaipf.utils.metrics_utils import get_metrics
+from genaipf.utils.log_utils import logger
+
+metrics = get_metrics("sse")
+
+
+class ClientDisconnected(Exception):
+    '''SSE 客户端已经断开连接'''
+
+
+class TextDelta(str):
+    '''回答的文本增量（未编码），由 SSEFrameWriter 合并后编码成 {"text": ...} 帧'''
+
+
+class SSEFrameWriter:
+    '''
+    合并写 SSE 帧：文本增量攒到 max_bytes 或 max_delay_ms 再写一帧，
+    其他帧（[GPT]、[DATA]、[DONE]、code 等）写之前先把攒着的文本带上一起立即写出
+    response.write 会等待 socket 可写，写不动时生产者也会在 send 上等待
+    on_frames(frames) 在写出之前拿到每一帧（不含 data: 前缀），断开后也不会漏帧；
+    detach() 之后只回调 on_frames，不再写 response
+    '''
+    def __init__(self, response, max_delay_ms=SSE_COALESCE_MS, max_bytes=SSE_COALESCE_BYTES, on_frames=None):
+        self.response = response
+        self.max_delay = max_delay_ms / 1000
+        self.max_bytes = max_bytes
+        self.on_frames = on_frames
+        self._pending = []
+        self._pending_bytes = 0
+        self._timer = None
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        self.t0 = time.time()
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+        self.disconnected = False
+        self.detached = False
+
+    def is_disconnected(self):
+        # sanic 的 ResponseStream 优先看 request.transport；
+        # 开始写之后 response.response.stream 是 Http 对象，也可以从它的 protocol 拿 transport
+        transport = getattr(getattr(self.response, "request", None), "transport", None)
+        if transport is None:
+            http = getattr(getattr(self.response, "response", None), "stream", None)
+            protocol = getattr(http, "protocol", None)
+            if protocol is None:
+                return False
+            transport = getattr(protocol, "transport", None)
+            if transport is None:
+                return True
+        return transport.is_closing()
+
+    def _check_connected(self):
+        if self.detached:
+            return
+        if self.disconnected or self.is_disconnected():
+            self.disconnected = True
+            raise ClientDisconnected()
+
+    def detach(self):
+        '''客户端已断开，之后的帧只交给 on_frames'''
+        self.disconnected = True
+        self.detached = True
+
+    def _take_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return []
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        return [text_frame(text)]
+
+    async def _write(self, *frames):
+        async with self._lock:
+            # 拿到锁之后再取文本，保证帧的顺序和 send 的顺序一致
+            frames = self._take_pending() + list(frames)
+            if not frames:
+                return
+            self.frames += len(frames)
+            if self.on_frames is not None:
+                self.on_frames(frames)
+            self._check_connected()
+            if self.detached:
+                return
+            data = "".join(f"data:{frame}\n\n" for frame in frames)
+            try:
+                await self.response.write(data)
+            except Exception:
+                if self.is_disconnected():
+                    self.disconnected = True
+                    raise ClientDisconnected()
+                raise
+            self.writes += 1
+            self.bytes += len(data)
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self._timer_flush())
+
+    async def _timer_flush(self):
+        try:
+            await self._write()
+        except ClientDisconnected:
+            # 下一次 send 会发现断开并通知生产者
+            pass
+        except Exception as e:
+            # 和 send 一样，写失败只记录，下一次 send 会再抛给生产者
+            logger.error(f'sse timer flush error {e}')
+
+    async def send(self, item):
+        if not isinstance(item, TextDelta):
+            await self._write(item)
+            return
+        if item:
+            self._pending.append(item)
+            self._pending_bytes += len(item.encode("utf-8"))
+        if self._pending_bytes >= self.max_bytes:
+            await self._write()
+            return
+        # 文本先收下再检查连接，detach 之后还能写给 on_frames
+        self._check_connected()
+        if self._pending and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+
+    async def send_frames(self, frames):
+        '''一次写出多个已编码的帧（续传回放用）'''
+        await self._write(*frames)
+
+    async def flush(self):
+        await self._write()
+
+    async def close(self):
+        '''写出剩余文本并记录本次流的统计'''
+        try:
+            await self.flush()
+        except ClientDisconnected:
+            pass
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            cost = max(time.time() - self.t0, 1e-3)
+            metrics.incr("streams")
+            if self.disconnected:
+                metrics.incr("disconnected_streams")
+            metrics.incr("frames", self.frames)
+            metrics.incr("writes", self.writes)
+            metrics.incr("bytes", self.bytes)
+            metrics.observe("stream_frames", self.frames)
+            metrics.observe("stream_bytes", self.bytes)
+            metrics.observe("stream_fps", self.frames / cost)
+            metrics.observe("stream_writes_per_sec", self.writes / cost)